@@ -0,0 +1,111 @@
+# answer_log.py
+# Buffered writes for the answer log. Answers are kept in memory and written as
+# one bulk insert plus one PlayerStats upsert per player/category/difficulty,
+# whenever ANSWER_FLUSH_SIZE answers are waiting or every ANSWER_FLUSH_INTERVAL.
+from datetime import datetime, timezone
+import threading
+import logging
+import atexit
+import os
+
+from database import add_answers
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = float(os.getenv('ANSWER_FLUSH_INTERVAL', 2))
+FLUSH_SIZE = int(os.getenv('ANSWER_FLUSH_SIZE', 500))
+# Answer rows kept through failed flushes before the oldest are dropped. Stats deltas are always kept
+MAX_PENDING = int(os.getenv('ANSWER_MAX_PENDING', 50000))
+
+
+def new_delta():
+    return {'answered': 0, 'correct': 0, 'leading': 0, 'trailing': 0, 'best': 0, 'all_correct': True}
+
+
+def merge_deltas(older, newer):
+    """One delta for two runs of answers, older first"""
+    return {
+        'answered': older['answered'] + newer['answered'],
+        'correct': older['correct'] + newer['correct'],
+        'leading': older['leading'] + newer['leading'] if older['all_correct'] else older['leading'],
+        'trailing': older['trailing'] + newer['trailing'] if newer['all_correct'] else newer['trailing'],
+        'best': max(older['best'], newer['best'], older['trailing'] + newer['leading']),
+        'all_correct': older['all_correct'] and newer['all_correct'],
+    }
+
+
+class AnswerLog:
+    def __init__(self, app, interval=FLUSH_INTERVAL, size=FLUSH_SIZE, max_pending=MAX_PENDING):
+        self.app = app
+        self.interval = interval
+        self.size = size
+        self.max_pending = max_pending
+        self._rows = []
+        self._deltas = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._wake = threading.Event()
+        atexit.register(self.flush)
+
+    def record(self, user_id, question_id, category, difficulty, correct, latency_ms=None):
+        row = {
+            'user_id': user_id,
+            'question_id': question_id,
+            'category': category,
+            'difficulty': difficulty,
+            'correct': correct,
+            'latency_ms': latency_ms,
+            'answered_at': datetime.now(timezone.utc).replace(tzinfo=None),
+        }
+        with self._lock:
+            self._rows.append(row)
+            delta = self._deltas.setdefault((user_id, category, difficulty), new_delta())
+            delta['answered'] += 1
+            if correct:
+                delta['correct'] += 1
+                delta['trailing'] += 1
+                if delta['all_correct']:
+                    delta['leading'] += 1
+                delta['best'] = max(delta['best'], delta['trailing'])
+            else:
+                delta['trailing'] = 0
+                delta['all_correct'] = False
+            full = len(self._rows) >= self.size
+
+            # Started on first use so it runs in the worker, not a preforked parent
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+        if full:
+            self._wake.set()  # Flush now, but on the flusher thread
+
+    def flush(self):
+        with self._lock:
+            rows, self._rows = self._rows, []
+            deltas, self._deltas = self._deltas, {}
+        if not rows:
+            return
+        try:
+            with self.app.app_context():
+                add_answers(rows, deltas)
+        except Exception as e:
+            logger.error(f"Answer log flush failed, keeping {len(rows)} answers for the next one: {str(e)}")
+            with self._lock:
+                # The failed batch is older than anything recorded since
+                self._rows = rows + self._rows
+                for key, delta in deltas.items():
+                    newer = self._deltas.get(key)
+                    self._deltas[key] = merge_deltas(delta, newer) if newer else delta
+                # Cap the raw log so an outage can't grow it without bound
+                dropped = len(self._rows) - self.max_pending
+                if dropped > 0:
+                    del self._rows[:dropped]
+            if dropped > 0:
+                logger.error(f"Answer log is over {self.max_pending} answers, dropped the oldest {dropped}")
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self.flush()
@@ -0,0 +1,75 @@
+# answer_token.py
+# Answer orderings are precomputed once, and each served question carries a small
+# signed token, so grading needs no question in the session.
+#
+# token = question id . served at (ms) . nonce . tag
+# tag   = HMAC-SHA256(question id, served at, nonce, correct index, answers shown)
+# The correct index is never sent. answer() tries every index against the tag
+# and only the real one matches.
+import itertools
+import hashlib
+import secrets
+import base64
+import random
+import hmac
+import time
+
+MAX_ANSWERS = 6
+TAG_BYTES = 16
+
+# Every ordering of n answers, with where the correct one (listed last) lands
+SHUFFLES = {n: [(order, order.index(n - 1)) for order in itertools.permutations(range(n))]
+            for n in range(1, MAX_ANSWERS + 1)}
+
+
+class InvalidToken(Exception):
+    """The answer token is malformed or wasn't signed by us"""
+
+
+def shuffle_answers(question):
+    """The question's answers in a random precomputed order, and the correct answer's index"""
+    answers = question['incorrectAnswers'] + [question['correctAnswer']]
+    order, correct = random.choice(SHUFFLES[len(answers)])
+    return [answers[i] for i in order], correct
+
+
+def new_nonce():
+    return secrets.token_urlsafe(6)
+
+
+class AnswerTokens:
+    def __init__(self, secret):
+        # With no secret the key would be public, and anyone could work out which index signs
+        if not secret:
+            raise ValueError("Answer tokens need a secret, set FLASK_SECRET_KEY")
+        # Separate key from the session signer's, derived from the same secret
+        self.key = hashlib.sha256(b'answer-token:' + secret.encode()).digest()
+
+    def deal(self, question, nonce):
+        """Shuffle a question's answers and sign them. Returns (answers, token)"""
+        answers, correct = shuffle_answers(question)
+        served_at = int(time.time() * 1000)
+        tag = self._tag(question['id'], served_at, nonce, correct, answers)
+        return answers, f"{question['id']}.{served_at}.{nonce}.{tag}"
+
+    def check(self, token, answers):
+        """Verify a token against the answers that were shown. Returns (question id, served at, nonce, correct index)"""
+        try:
+            question_id, served_at, nonce, tag = token.rsplit('.', 3)
+            served_at = int(served_at)
+        except (AttributeError, ValueError):
+            raise InvalidToken("Malformed answer token")
+
+        # Check every index, so timing doesn't reveal which one matched
+        correct = None
+        for i in range(min(len(answers), MAX_ANSWERS)):
+            if hmac.compare_digest(self._tag(question_id, served_at, nonce, i, answers), tag):
+                correct = i
+        if correct is None:
+            raise InvalidToken("Answer token signature does not match")
+        return question_id, served_at / 1000, nonce, correct
+
+    def _tag(self, question_id, served_at, nonce, correct, answers):
+        message = '\x1f'.join([question_id, str(served_at), nonce, str(correct)] + list(answers))
+        digest = hmac.new(self.key, message.encode('utf-8'), hashlib.sha256).digest()[:TAG_BYTES]
+        return base64.urlsafe_b64encode(digest).rstrip(b'=').decode('ascii')
@@ -0,0 +1,14 @@
+# async_app.py
+# Async entry point for the same Flask app. Run it on gevent workers so each worker
+# multiplexes many players while they wait on the trivia API or the database:
+#
+#   gunicorn -k gevent --worker-connections 1000 -w 4 async_app:app
+#
+# trivia_game:app is still the plain WSGI entry point for sync workers.
+from gevent import monkey
+monkey.patch_all()  # Must happen before anything imports socket, ssl or threading
+
+from psycogreen.gevent import patch_psycopg
+patch_psycopg()  # Let psycopg2 yield to other greenlets while it waits on Postgres
+
+from trivia_game import app  # noqa: E402
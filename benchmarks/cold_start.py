@@ -0,0 +1,81 @@
+# benchmarks/cold_start.py
+# Measure how long a fresh container takes to become useful: the app's import
+# time, and time from launching gunicorn to the first successful response,
+# with and without preload and fast boot.
+#
+#   python benchmarks/cold_start.py --workers 4 --runs 5
+import argparse
+import statistics
+import subprocess
+import tempfile
+import time
+import sys
+import os
+
+import requests
+
+from loadtest import ROOT, free_port, app_env, create_tables
+from fake_trivia_api import FakeTriviaAPI
+
+CONFIGS = [
+    # (name, GUNICORN_PRELOAD, FAST_BOOT)
+    ('per-worker import', 'false', 'false'),
+    ('fast boot', 'false', 'true'),
+    ('preload + fast boot', 'true', 'true'),
+]
+
+IMPORT_CODE = "import time; t = time.perf_counter(); import trivia_game; print(time.perf_counter() - t)"
+
+
+def import_time(env):
+    out = subprocess.run([sys.executable, '-c', IMPORT_CODE], cwd=ROOT, env=env,
+                         check=True, capture_output=True, text=True).stdout
+    return float(out.strip().splitlines()[-1])
+
+
+def time_to_first_request(env, workers, workdir):
+    port = free_port()
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', os.path.join(ROOT, 'gunicorn.conf.py'),
+         '-w', str(workers), '-b', f'127.0.0.1:{port}', 'trivia_game:app'],
+        cwd=workdir, env=dict(env, PYTHONPATH=ROOT),
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while True:
+            try:
+                if requests.get(f"http://127.0.0.1:{port}/", timeout=1).status_code == 200:
+                    return time.perf_counter() - started
+            except requests.RequestException:
+                pass
+            if server.poll() is not None:
+                raise RuntimeError("gunicorn exited before serving a request")
+            time.sleep(0.01)
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold start and time to first request")
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    api = FakeTriviaAPI().start()
+    workdir = tempfile.mkdtemp(prefix='cold-start-')
+    base_env = app_env(api.url, workdir)
+    create_tables(base_env)
+
+    print(f"{args.workers} workers, median of {args.runs} runs")
+    print(f"{'config':<22}{'import ms':>11}{'first request ms':>18}")
+    for name, preload, fast_boot in CONFIGS:
+        env = dict(base_env, GUNICORN_PRELOAD=preload, FAST_BOOT=fast_boot)
+        imports = [import_time(env) for _ in range(args.runs)]
+        firsts = [time_to_first_request(env, args.workers, workdir) for _ in range(args.runs)]
+        print(f"{name:<22}{statistics.median(imports) * 1000:>11.0f}{statistics.median(firsts) * 1000:>18.0f}")
+    api.stop()
+
+
+if __name__ == "__main__":
+    main()
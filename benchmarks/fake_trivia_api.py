@@ -0,0 +1,114 @@
+# benchmarks/fake_trivia_api.py
+# A local stand-in for the-trivia-api's /v2/questions endpoint, with configurable
+# latency and injected 429 responses.
+#
+#   python benchmarks/fake_trivia_api.py --port 9000 --latency 0.2 --rate-limit 0.1
+import argparse
+import itertools
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+_ids = itertools.count()
+
+
+def make_question(category, difficulty):
+    n = next(_ids)
+    return {
+        "id": f"fake-{n}",
+        "category": category,
+        "difficulty": difficulty,
+        "question": {"text": f"Fake question {n}?"},
+        "correctAnswer": f"Right {n}",
+        "incorrectAnswers": [f"Wrong {n}a", f"Wrong {n}b", f"Wrong {n}c"],
+        "type": "text_choice",
+        "tags": [],
+        "regions": [],
+        "isNiche": False,
+    }
+
+
+class FakeTriviaHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != '/v2/questions':
+            self.send_error(404)
+            return
+
+        query = parse_qs(url.query)
+        category = query.get('categories', ['general_knowledge'])[0]
+        difficulty = query.get('difficulties', ['easy'])[0]
+        limit = min(int(query.get('limit', ['10'])[0]), 50)
+
+        self.server.requests += 1
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        if random.random() < self.server.rate_limit:
+            self.server.rate_limited += 1
+            self.send_response(429)
+            self.send_header('Retry-After', '5')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        body = json.dumps([make_question(category, difficulty) for _ in range(limit)]).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeTriviaAPI:
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, rate_limit=0.0):
+        self.server = ThreadingHTTPServer((host, port), FakeTriviaHandler)
+        self.server.daemon_threads = True
+        self.server.latency = latency
+        self.server.rate_limit = rate_limit  # Share of requests answered with 429
+        self.server.requests = 0
+        self.server.rate_limited = 0
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/v2/questions"
+
+    @property
+    def requests(self):
+        return self.server.requests
+
+    @property
+    def rate_limited(self):
+        return self.server.rate_limited
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a fake trivia API")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9000)
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds to wait before each response")
+    parser.add_argument('--rate-limit', type=float, default=0.0, help="Share of requests answered with 429")
+    args = parser.parse_args()
+
+    api = FakeTriviaAPI(args.host, args.port, args.latency, args.rate_limit)
+    print(f"Fake trivia API on {api.url}")
+    api.server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
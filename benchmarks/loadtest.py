@@ -0,0 +1,194 @@
+# benchmarks/loadtest.py
+# Compare how many players one worker can serve in sync and async (gevent) mode.
+#
+#   python benchmarks/loadtest.py --players 50 --duration 20 --latency 0.2
+#
+# Each mode starts one gunicorn worker against a fake trivia API that answers after
+# --latency seconds, with the question pool turned down to one question per fetch so
+# every ask_question waits on the upstream. Players loop ask_question -> answer.
+import argparse
+import html
+import os
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+from fake_trivia_api import FakeTriviaAPI
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CSRF_RE = re.compile(r'name="csrf_token" type="hidden" value="([^"]+)"')
+TOKEN_RE = re.compile(r'name="token" value="([^"]+)"')
+CHOICE_RE = re.compile(r'name="choice" value="([^"]*)"')
+
+# Players are spread over every category and difficulty. The pool fetches one
+# batch per bucket at a time, so players sharing a bucket would queue on each other
+CATEGORIES = ('music', 'sport_and_leisure', 'film_and_tv', 'arts_and_literature', 'history',
+              'society_and_culture', 'science', 'geography', 'food_and_drink', 'general_knowledge')
+DIFFICULTIES = ('easy', 'medium', 'hard')
+
+MODES = {
+    'sync': ['-k', 'sync', 'trivia_game:app'],
+    'async': ['-k', 'gevent', '--worker-connections', '1000', 'async_app:app'],
+}
+
+
+def answer_form(page):
+    """The answer POST for a question page: the signed token, the answers shown and a pick"""
+    token = TOKEN_RE.search(page)
+    if not token:
+        return None
+    return {'token': html.unescape(token.group(1)), 'answer': '0',
+            'choice': [html.unescape(c) for c in CHOICE_RE.findall(page)]}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Server on port {port} did not start")
+
+
+def app_env(api_url, workdir):
+    env = dict(os.environ)
+    env.update({
+        'DATABASE_PUBLIC_URL': f"sqlite:///{os.path.join(workdir, 'loadtest.db')}",
+        'FLASK_SECRET_KEY': 'loadtest',
+        'SESSION_COOKIE_SECURE': 'false',
+        'TRIVIA_API_URL': api_url,
+        'TRIVIA_API_RATE': '1000000',
+        'TRIVIA_API_BURST': '1000000',
+        'TRIVIA_API_BUCKET_FILE': os.path.join(workdir, 'bucket'),
+        'QUESTION_POOL_BATCH_SIZE': '1',
+        'QUESTION_POOL_LOW_WATER': '0',
+        'RATELIMIT_ENABLED': 'false',
+    })
+    return env
+
+
+def create_tables(env):
+    code = "from trivia_game import app, db\nwith app.app_context(): db.create_all()"
+    subprocess.run([sys.executable, '-c', code], cwd=ROOT, env=env, check=True)
+
+
+def sign_up(base, name):
+    """Register and log in one player, returning their HTTP session"""
+    http = requests.Session()
+    token = CSRF_RE.search(http.get(f"{base}/register").text).group(1)
+    http.post(f"{base}/register", data={'csrf_token': token, 'username': name,
+                                        'email': f"{name}@example.com", 'password': 'pw'})
+    token = CSRF_RE.search(http.get(f"{base}/").text).group(1)
+    http.post(f"{base}/login", data={'csrf_token': token, 'username': name, 'password': 'pw'})
+    return http
+
+
+def play(base, http, player, stop, latencies, errors):
+    category = CATEGORIES[player % len(CATEGORIES)]
+    difficulty = DIFFICULTIES[player // len(CATEGORIES) % len(DIFFICULTIES)]
+    url = f"{base}/ask_question?category={category}&difficulty={difficulty}"
+    # Sign-up connections sat idle past gunicorn's keep-alive while the others
+    # registered, so start on fresh ones rather than a socket the server dropped
+    http.close()
+    while not stop.is_set():
+        started = time.perf_counter()
+        try:
+            page = http.get(url, timeout=60)
+            form = answer_form(page.text)
+            if not form:
+                errors.append(f"ask_question {page.status_code}")
+                continue
+            response = http.post(f"{base}/answer", data=form, timeout=60)
+            if response.status_code != 200 or 'Answer Result' not in response.text:
+                errors.append(f"answer {response.status_code}")
+                continue
+        except requests.RequestException as e:
+            errors.append(type(e).__name__)
+            continue
+        latencies.append(time.perf_counter() - started)
+
+
+def run_mode(mode, args, api):
+    workdir = tempfile.mkdtemp(prefix=f"loadtest-{mode}-")
+    env = app_env(api.url, workdir)
+    create_tables(env)
+
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-w', '1', '-t', '120', '-b', f'127.0.0.1:{port}'] + MODES[mode],
+        cwd=workdir, env=dict(env, PYTHONPATH=ROOT),
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_port(port)
+        base = f"http://127.0.0.1:{port}"
+        players = [sign_up(base, f"{mode}{i}") for i in range(args.players)]
+
+        stop = threading.Event()
+        latencies, errors = [], []
+        threads = [threading.Thread(target=play, args=(base, http, i, stop, latencies, errors))
+                   for i, http in enumerate(players)]
+        for t in threads:
+            t.start()
+        time.sleep(args.duration)
+        stop.set()
+        for t in threads:
+            t.join()
+    finally:
+        server.terminate()
+        server.wait()
+
+    rounds = len(latencies)
+    throughput = rounds / args.duration
+    mean = sum(latencies) / rounds if rounds else 0
+    # Every round waits on the upstream once, so players served at the same time
+    # by the worker = rounds per second x upstream latency (Little's law)
+    concurrent = throughput * args.latency
+    return {'mode': mode, 'rounds': rounds, 'errors': errors,
+            'throughput': throughput, 'mean': mean, 'concurrent': concurrent}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test sync vs async serving for one worker")
+    parser.add_argument('--players', type=int, default=50)
+    parser.add_argument('--duration', type=float, default=20)
+    parser.add_argument('--latency', type=float, default=0.2, help="Fake trivia API latency in seconds")
+    parser.add_argument('--modes', nargs='+', default=list(MODES), choices=list(MODES))
+    args = parser.parse_args()
+
+    api = FakeTriviaAPI(latency=args.latency).start()
+    try:
+        results = [run_mode(mode, args, api) for mode in args.modes]
+    finally:
+        api.stop()
+
+    # A run with failed rounds doesn't measure serving capacity, so don't report one
+    failed = [r for r in results if r['errors']]
+    for r in failed:
+        print(f"{r['mode']}: {len(r['errors'])} failed rounds, e.g. {', '.join(sorted(set(r['errors']))[:5])}",
+              file=sys.stderr)
+    if failed:
+        return 1
+
+    print(f"{args.players} players, {args.duration:.0f}s, upstream latency {args.latency * 1000:.0f} ms, 1 worker")
+    print(f"{'mode':<8}{'rounds/s':>10}{'mean ms':>10}{'concurrent players':>20}")
+    for r in results:
+        print(f"{r['mode']:<8}{r['throughput']:>10.1f}{r['mean'] * 1000:>10.0f}{r['concurrent']:>20.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
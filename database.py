@@ -1,11 +1,14 @@
 # database.py
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
-from flask_bcrypt import Bcrypt
+from sqlalchemy.dialects import postgresql, sqlite
+
+import random
+
+from password_hasher import password_hasher
 
 # Create a SQLAlchemy instance
 db = SQLAlchemy()
-bcrypt = Bcrypt()
 
 # Define the Player model
 class User(UserMixin, db.Model):  # UserMixin helps with login functionality
@@ -13,12 +16,271 @@ class User(UserMixin, db.Model):  # UserMixin helps with login functionality
     username = db.Column(db.String(80), unique=True, nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
     password_hash = db.Column(db.String(256), nullable=True)  # Store hashed password
-    score = db.Column(db.Integer, default=0)
+    score = db.Column(db.Integer, default=0, index=True)  # Indexed for the leaderboard
 
     def set_password(self, password):
-        """Hash and set the password using bcrypt"""
-        self.password_hash = bcrypt.generate_password_hash(password).decode('utf-8')
+        """Hash and set the password using bcrypt, off the request worker"""
+        self.password_hash = password_hasher.hash(password)
 
     def check_password(self, password):
-        """Verify the password using bcrypt"""
-        return bcrypt.check_password_hash(self.password_hash, password)
+        """Verify the password using bcrypt, off the request worker"""
+        return password_hasher.check(password, self.password_hash)
+
+    def password_needs_rehash(self):
+        """True if the stored hash uses a different cost than BCRYPT_LOG_ROUNDS"""
+        return password_hasher.needs_rehash(self.password_hash)
+
+# Per category and difficulty scores, for the leaderboard
+class CategoryScore(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    category = db.Column(db.String(50), primary_key=True)
+    difficulty = db.Column(db.String(10), primary_key=True)
+    score = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.Index('ix_category_score_board', 'category', 'difficulty', 'score'),
+    )
+
+# Append-only log of every answer
+class Answer(db.Model):
+    id = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    question_id = db.Column(db.String(64), nullable=False)  # The trivia API's id
+    category = db.Column(db.String(50), nullable=False)
+    difficulty = db.Column(db.String(10), nullable=False)
+    correct = db.Column(db.Boolean, nullable=False)
+    latency_ms = db.Column(db.Integer, nullable=True)  # From question served to answer received
+    answered_at = db.Column(db.DateTime, nullable=False)
+
+# Running per player/category/difficulty aggregates of the answer log
+class PlayerStats(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    category = db.Column(db.String(50), primary_key=True)
+    difficulty = db.Column(db.String(10), primary_key=True)
+    answered = db.Column(db.Integer, nullable=False, default=0)
+    correct = db.Column(db.Integer, nullable=False, default=0)
+    current_streak = db.Column(db.Integer, nullable=False, default=0)
+    best_streak = db.Column(db.Integer, nullable=False, default=0)
+
+    @property
+    def accuracy(self):
+        return self.correct / self.answered if self.answered else 0
+
+# Each player's seen-filter (see seen_filter.py), kept here rather than in the session
+class SeenQuestions(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    bits = db.Column(db.LargeBinary, nullable=False)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+# Define the Question model (the local question bank)
+class Question(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    api_id = db.Column(db.String(64), unique=True, nullable=False)  # The trivia API's id, used to dedupe
+    category = db.Column(db.String(50), nullable=False)
+    difficulty = db.Column(db.String(10), nullable=False)
+    text = db.Column(db.Text, nullable=False)
+    correct_answer = db.Column(db.Text, nullable=False)
+    incorrect_answers = db.Column(db.JSON, nullable=False)
+    random_key = db.Column(db.Float, nullable=False, default=random.random)  # Uniform in [0, 1), used for random picks
+
+    __table_args__ = (
+        db.Index('ix_question_category_difficulty_random_key', 'category', 'difficulty', 'random_key'),
+    )
+
+    @classmethod
+    def random(cls, category, difficulty):
+        """Pick a random question with one index seek instead of ORDER BY random()"""
+        bucket = cls.query.filter_by(category=category, difficulty=difficulty)
+        key = random.random()
+        question = bucket.filter(cls.random_key >= key).order_by(cls.random_key).first()
+        if question is None:
+            # Wrap around to the lowest key
+            question = bucket.order_by(cls.random_key).first()
+        return question
+
+    @classmethod
+    def random_batch(cls, category, difficulty, limit):
+        """Pick up to limit questions that sit next to each other from a random starting key"""
+        bucket = cls.query.filter_by(category=category, difficulty=difficulty)
+        key = random.random()
+        questions = bucket.filter(cls.random_key >= key).order_by(cls.random_key).limit(limit).all()
+        if len(questions) < limit:
+            # Wrap around to the lowest keys
+            questions += bucket.filter(cls.random_key < key).order_by(cls.random_key).limit(limit - len(questions)).all()
+        return questions
+
+    def to_dict(self):
+        """Return the question in the trivia API's format"""
+        return {
+            'id': self.api_id,
+            'category': self.category,
+            'difficulty': self.difficulty,
+            'question': {'text': self.text},
+            'correctAnswer': self.correct_answer,
+            'incorrectAnswers': list(self.incorrect_answers),
+        }
+
+
+def add_score(user_id, points, category, difficulty):
+    """Add points with one atomic UPDATE ... RETURNING and give back the new score"""
+    stmt = (db.update(User)
+            .where(User.id == user_id)
+            .values(score=db.func.coalesce(User.score, 0) + points)
+            .returning(User.score))
+    score = db.session.execute(stmt).scalar_one()
+    _add_category_scores([(user_id, category, difficulty, points)])
+    db.session.commit()
+    return score
+
+
+def add_scores(increments):
+    """Apply {(user_id, category, difficulty): points} with one executemany UPDATE and one upsert"""
+    if not increments:
+        return
+    totals = {}
+    for (user_id, _, _), points in increments.items():
+        totals[user_id] = totals.get(user_id, 0) + points
+
+    users = User.__table__
+    stmt = (users.update()
+            .where(users.c.id == db.bindparam('user_id'))
+            .values(score=db.func.coalesce(users.c.score, 0) + db.bindparam('points')))
+    db.session.execute(stmt, [{'user_id': user_id, 'points': points} for user_id, points in totals.items()])
+    _add_category_scores([key + (points,) for key, points in increments.items()])
+    db.session.commit()
+
+
+def _add_category_scores(rows):
+    """Upsert (user_id, category, difficulty, points) rows into CategoryScore"""
+    insert = upsert_insert(CategoryScore)
+    if insert is None:
+        # No ON CONFLICT, so update and insert whatever was missing
+        for user_id, category, difficulty, points in rows:
+            row = db.session.get(CategoryScore, (user_id, category, difficulty))
+            if row is None:
+                db.session.add(CategoryScore(user_id=user_id, category=category, difficulty=difficulty, score=points))
+            else:
+                row.score += points
+        return
+
+    values = [{'user_id': u, 'category': c, 'difficulty': d, 'score': p} for u, c, d, p in rows]
+    stmt = insert.values(values)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['user_id', 'category', 'difficulty'],
+        set_={'score': CategoryScore.score + stmt.excluded.score})
+    db.session.execute(stmt)
+
+
+def add_answers(rows, deltas):
+    """Bulk insert answer rows and fold the batch's deltas into PlayerStats
+
+    deltas maps (user_id, category, difficulty) to a dict of answered, correct,
+    leading (correct answers before the first miss), trailing (correct answers
+    after the last miss), best (longest run) and all_correct.
+    """
+    if rows:
+        db.session.execute(db.insert(Answer), rows)  # executemany, batched into multi-row VALUES
+
+    params = [{'user_id': u, 'category': c, 'difficulty': d, **delta} for (u, c, d), delta in deltas.items()]
+    insert = upsert_insert(PlayerStats)
+    if insert is None:
+        # No ON CONFLICT, so update in Python
+        for p in params:
+            stats = db.session.get(PlayerStats, (p['user_id'], p['category'], p['difficulty']))
+            if stats is None:
+                stats = PlayerStats(user_id=p['user_id'], category=p['category'], difficulty=p['difficulty'],
+                                    answered=0, correct=0, current_streak=0, best_streak=0)
+                db.session.add(stats)
+            stats.best_streak = max(stats.best_streak, stats.current_streak + p['leading'], p['best'])
+            stats.current_streak = stats.current_streak + p['trailing'] if p['all_correct'] else p['trailing']
+            stats.best_streak = max(stats.best_streak, stats.current_streak)
+            stats.answered += p['answered']
+            stats.correct += p['correct']
+    elif params:
+        greatest = db.func.greatest if db.session.get_bind().dialect.name == 'postgresql' else db.func.max
+        bp = db.bindparam
+        current = db.case((bp('all_correct', type_=db.Boolean), PlayerStats.current_streak + bp('trailing')),
+                          else_=bp('trailing'))
+        stmt = insert.values(user_id=bp('user_id'), category=bp('category'), difficulty=bp('difficulty'),
+                             answered=bp('answered'), correct=bp('correct'),
+                             current_streak=bp('trailing'), best_streak=bp('best'))
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['user_id', 'category', 'difficulty'],
+            set_={
+                'answered': PlayerStats.answered + bp('answered'),
+                'correct': PlayerStats.correct + bp('correct'),
+                'current_streak': current,
+                'best_streak': greatest(PlayerStats.best_streak,
+                                        PlayerStats.current_streak + bp('leading'),
+                                        bp('best'), current),
+            })
+        db.session.execute(stmt, params)
+    db.session.commit()
+
+
+def save_seen(user_id, bits, count):
+    """Store a player's seen-filter with one upsert"""
+    values = {'user_id': user_id, 'bits': bits, 'count': count}
+    insert = upsert_insert(SeenQuestions)
+    if insert is not None:
+        stmt = insert.values(**values).on_conflict_do_update(
+            index_elements=['user_id'], set_={'bits': bits, 'count': count})
+        db.session.execute(stmt)
+    else:
+        db.session.merge(SeenQuestions(**values))
+    db.session.commit()
+
+
+def category_slug(category):
+    """Turn a v1 category name like 'Film & TV' into the v2 form 'film_and_tv'"""
+    return category.strip().lower().replace('&', 'and').replace(' ', '_')
+
+
+def question_row(data):
+    """Map one trivia API question (v1 or v2 format) to a Question row"""
+    text = data['question']
+    if isinstance(text, dict):
+        text = text['text']
+    return {
+        'api_id': data['id'],
+        'category': category_slug(data['category']),
+        'difficulty': data['difficulty'],
+        'text': text,
+        'correct_answer': data['correctAnswer'],
+        'incorrect_answers': list(data['incorrectAnswers']),
+        'random_key': random.random(),
+    }
+
+
+def upsert_insert(model):
+    """The dialect's INSERT that supports ON CONFLICT, or None if there isn't one"""
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        return postgresql.insert(model)
+    if dialect == 'sqlite':
+        return sqlite.insert(model)
+    return None
+
+
+def save_questions(questions):
+    """Insert questions in one multi-row statement, skipping ones already in the bank"""
+    # Dedupe within the batch too, keyed by the API id
+    rows = list({row['api_id']: row for row in map(question_row, questions)}.values())
+    if not rows:
+        return 0
+
+    insert = upsert_insert(Question)
+    if insert is not None:
+        stmt = insert.values(rows).on_conflict_do_nothing(index_elements=['api_id'])
+    else:
+        # No portable upsert, so drop the ids we already have first
+        existing = {api_id for (api_id,) in db.session.query(Question.api_id).filter(
+            Question.api_id.in_([row['api_id'] for row in rows]))}
+        rows = [row for row in rows if row['api_id'] not in existing]
+        if not rows:
+            return 0
+        stmt = db.insert(Question).values(rows)
+
+    result = db.session.execute(stmt)
+    db.session.commit()
+    return result.rowcount
@@ -0,0 +1,46 @@
+# gunicorn.conf.py
+# Picked up automatically when gunicorn is started from this directory.
+import gc
+import os
+
+# Serving processes skip CLI-only setup like Flask-Migrate (see trivia_game.py)
+os.environ.setdefault('FAST_BOOT', 'true')
+
+# Import the app once in the master and fork the workers from it, so they start
+# warm and share its memory pages. GUNICORN_PRELOAD=false imports in each worker
+preload_app = os.getenv('GUNICORN_PRELOAD', 'true').lower() == 'true'
+
+
+def when_ready(server):
+    # Workers inherit this. With several of them, memory:// live rooms are turned off
+    os.environ['GUNICORN_WORKERS'] = str(server.cfg.workers)
+    rooms_uri = os.getenv('ROOMS_STORAGE_URI', os.getenv('RATELIMIT_STORAGE_URI', 'memory://'))
+    if server.cfg.workers > 1 and rooms_uri.startswith('memory://'):
+        server.log.error(f"Live rooms are off: they are kept in memory and there are {server.cfg.workers} "
+                         f"workers. Set ROOMS_STORAGE_URI to Redis/Valkey")
+
+    # memory:// counters are per process, so with several workers each one
+    # allows the full quota
+    if server.cfg.workers > 1 and os.getenv('RATELIMIT_STORAGE_URI', 'memory://').startswith('memory://'):
+        server.log.error(f"RATELIMIT_STORAGE_URI is memory:// with {server.cfg.workers} workers: "
+                         f"rate limits are counted per worker. Point it at Redis/Valkey")
+
+    # Keep the GC away from everything loaded so far, so workers don't copy
+    # the master's pages just by collecting them
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    if preload_app:
+        # Pooled connections from the master must not be shared by workers
+        from trivia_game import app
+        from database import db
+        with app.app_context():
+            db.engine.dispose(close=False)
+
+
+def child_exit(server, worker):
+    # Drop a dead worker's live gauges from the shared Prometheus directory
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
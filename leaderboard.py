@@ -0,0 +1,62 @@
+# leaderboard.py
+# Global and per category/difficulty leaderboards. Top-N pages are cached for a few
+# seconds per worker; ranks are counted off the score indexes, never a table scan.
+import threading
+import time
+import os
+
+from database import db, User, CategoryScore
+
+LEADERBOARD_SIZE = int(os.getenv('LEADERBOARD_SIZE', 10))
+LEADERBOARD_TTL = float(os.getenv('LEADERBOARD_TTL', 5))  # Seconds
+
+
+class Leaderboard:
+    def __init__(self, size=LEADERBOARD_SIZE, ttl=LEADERBOARD_TTL):
+        self.size = size
+        self.ttl = ttl
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def top(self, category=None, difficulty=None):
+        """[(username, score), ...] for the best players, cached for ttl seconds"""
+        key = (category, difficulty)
+        now = time.monotonic()
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached and cached[0] > now:
+                return cached[1]
+
+        rows = db.session.execute(self._board(category, difficulty).limit(self.size)).all()
+        top = [(username, score) for username, score in rows]
+        with self._lock:
+            self._cache[key] = (now + self.ttl, top)
+        return top
+
+    def rank(self, user_id, category=None, difficulty=None):
+        """(rank, score) for one player, or None if they have no score on this board"""
+        if category and difficulty:
+            score = db.session.scalar(db.select(CategoryScore.score).where(
+                CategoryScore.user_id == user_id,
+                CategoryScore.category == category,
+                CategoryScore.difficulty == difficulty))
+            if score is None:
+                return None
+            # Range count on ix_category_score_board
+            ahead = db.session.scalar(db.select(db.func.count()).select_from(CategoryScore).where(
+                CategoryScore.category == category,
+                CategoryScore.difficulty == difficulty,
+                CategoryScore.score > score))
+        else:
+            score = db.session.scalar(db.select(User.score).where(User.id == user_id)) or 0
+            # Range count on the User.score index
+            ahead = db.session.scalar(db.select(db.func.count()).select_from(User).where(User.score > score))
+        return ahead + 1, score
+
+    def _board(self, category, difficulty):
+        if category and difficulty:
+            return (db.select(User.username, CategoryScore.score)
+                    .join(User, User.id == CategoryScore.user_id)
+                    .where(CategoryScore.category == category, CategoryScore.difficulty == difficulty)
+                    .order_by(CategoryScore.score.desc()))
+        return db.select(User.username, User.score).order_by(User.score.desc())
@@ -0,0 +1,114 @@
+# metrics.py
+# Prometheus metrics for the app, served at /metrics. Request latency per route is
+# broken down into upstream fetch, database, template render and session time.
+#
+# /metrics is off unless METRICS_TOKEN is set, and then scrapers must send
+# `Authorization: Bearer <METRICS_TOKEN>`.
+#
+# Under gunicorn set PROMETHEUS_MULTIPROC_DIR to an empty directory before the
+# workers start; each worker then writes its samples there and /metrics adds them
+# up across workers (gunicorn.conf.py cleans up after exited workers).
+import hmac
+import time
+import os
+
+from flask import Response, abort, g, request, has_request_context, before_render_template, template_rendered
+from prometheus_client import (Counter, Histogram, CollectorRegistry, generate_latest,
+                               CONTENT_TYPE_LATEST, REGISTRY, multiprocess)
+from sqlalchemy import event
+
+MULTIPROC_DIR = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
+REQUEST_SECONDS = Histogram('trivia_request_seconds', 'Request latency', ['route'])
+REQUESTS = Counter('trivia_requests_total', 'Requests served', ['route', 'status'])
+DB_SECONDS = Histogram('trivia_db_query_seconds', 'Time per database statement', ['route'])
+TEMPLATE_SECONDS = Histogram('trivia_template_render_seconds', 'Template render time', ['template'])
+SESSION_SECONDS = Histogram('trivia_session_seconds', 'Session load and save time', ['operation'])
+UPSTREAM_SECONDS = Histogram('trivia_upstream_seconds', 'Trivia API request time')
+UPSTREAM_RESPONSES = Counter('trivia_upstream_responses_total', 'Trivia API responses', ['status'])
+UPSTREAM_RATE_LIMITED = Counter('trivia_upstream_rate_limited_total', 'Trivia API 429 responses')
+
+
+def current_route():
+    if has_request_context():
+        return request.endpoint or 'unmatched'
+    return 'background'
+
+
+class TimedSessionInterface:
+    """Wrap the app's session interface and time every load and save"""
+
+    def __init__(self, inner):
+        self.inner = inner
+
+    def open_session(self, app, request):
+        started = time.perf_counter()
+        try:
+            return self.inner.open_session(app, request)
+        finally:
+            SESSION_SECONDS.labels('load').observe(time.perf_counter() - started)
+
+    def save_session(self, app, session, response):
+        started = time.perf_counter()
+        try:
+            return self.inner.save_session(app, session, response)
+        finally:
+            SESSION_SECONDS.labels('save').observe(time.perf_counter() - started)
+
+    def __getattr__(self, name):
+        return getattr(self.inner, name)
+
+
+def init_metrics(app, db):
+    @app.before_request
+    def start_timer():
+        g.metrics_started = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        started = g.pop('metrics_started', None)
+        if started is not None:
+            route = current_route()
+            REQUEST_SECONDS.labels(route).observe(time.perf_counter() - started)
+            REQUESTS.labels(route, response.status_code).inc()
+        return response
+
+    def before_render(sender, template, context, **extra):
+        g.setdefault('metrics_render_started', []).append(time.perf_counter())
+
+    def after_render(sender, template, context, **extra):
+        stack = g.get('metrics_render_started')
+        if stack:
+            TEMPLATE_SECONDS.labels(template.name).observe(time.perf_counter() - stack.pop())
+
+    before_render_template.connect(before_render, app)
+    template_rendered.connect(after_render, app)
+
+    app.session_interface = TimedSessionInterface(app.session_interface)
+
+    with app.app_context():
+        engine = db.engine
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_query(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('metrics_query_started', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_query(conn, cursor, statement, parameters, context, executemany):
+        stack = conn.info.get('metrics_query_started')
+        if stack:
+            DB_SECONDS.labels(current_route()).observe(time.perf_counter() - stack.pop())
+
+    @app.route('/metrics')
+    def metrics():
+        if not METRICS_TOKEN:
+            abort(404)
+        if not hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {METRICS_TOKEN}"):
+            return Response('Unauthorized', 401, {'WWW-Authenticate': 'Bearer'})
+        if MULTIPROC_DIR:
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+        else:
+            registry = REGISTRY
+        return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
@@ -0,0 +1,37 @@
+"""user table
+
+The schema the app had before migrations were checked in. A database created
+by the old per-boot `flask db init && flask db migrate` already has it, so
+stamp those with `flask db stamp 0001` once and upgrade from there.
+
+Revision ID: 0001
+Revises: 
+Create Date: 2026-10-18 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('user',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('username', sa.String(length=80), nullable=False),
+    sa.Column('email', sa.String(length=120), nullable=False),
+    sa.Column('password_hash', sa.String(length=256), nullable=True),
+    sa.Column('score', sa.Integer(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('email'),
+    sa.UniqueConstraint('username')
+    )
+
+
+def downgrade():
+    op.drop_table('user')
@@ -0,0 +1,92 @@
+"""question bank, leaderboard scores, answer log and player stats
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_user_score'), ['score'], unique=False)
+
+    op.create_table('question',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('api_id', sa.String(length=64), nullable=False),
+    sa.Column('category', sa.String(length=50), nullable=False),
+    sa.Column('difficulty', sa.String(length=10), nullable=False),
+    sa.Column('text', sa.Text(), nullable=False),
+    sa.Column('correct_answer', sa.Text(), nullable=False),
+    sa.Column('incorrect_answers', sa.JSON(), nullable=False),
+    sa.Column('random_key', sa.Float(), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('api_id')
+    )
+    with op.batch_alter_table('question', schema=None) as batch_op:
+        batch_op.create_index('ix_question_category_difficulty_random_key', ['category', 'difficulty', 'random_key'], unique=False)
+
+    op.create_table('category_score',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('category', sa.String(length=50), nullable=False),
+    sa.Column('difficulty', sa.String(length=10), nullable=False),
+    sa.Column('score', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('user_id', 'category', 'difficulty')
+    )
+    with op.batch_alter_table('category_score', schema=None) as batch_op:
+        batch_op.create_index('ix_category_score_board', ['category', 'difficulty', 'score'], unique=False)
+
+    op.create_table('answer',
+    sa.Column('id', sa.BigInteger().with_variant(sa.Integer(), 'sqlite'), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('question_id', sa.String(length=64), nullable=False),
+    sa.Column('category', sa.String(length=50), nullable=False),
+    sa.Column('difficulty', sa.String(length=10), nullable=False),
+    sa.Column('correct', sa.Boolean(), nullable=False),
+    sa.Column('latency_ms', sa.Integer(), nullable=True),
+    sa.Column('answered_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('answer', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_answer_user_id'), ['user_id'], unique=False)
+
+    op.create_table('player_stats',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('category', sa.String(length=50), nullable=False),
+    sa.Column('difficulty', sa.String(length=10), nullable=False),
+    sa.Column('answered', sa.Integer(), nullable=False),
+    sa.Column('correct', sa.Integer(), nullable=False),
+    sa.Column('current_streak', sa.Integer(), nullable=False),
+    sa.Column('best_streak', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('user_id', 'category', 'difficulty')
+    )
+
+
+def downgrade():
+    op.drop_table('player_stats')
+    with op.batch_alter_table('answer', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_answer_user_id'))
+
+    op.drop_table('answer')
+    with op.batch_alter_table('category_score', schema=None) as batch_op:
+        batch_op.drop_index('ix_category_score_board')
+
+    op.drop_table('category_score')
+    with op.batch_alter_table('question', schema=None) as batch_op:
+        batch_op.drop_index('ix_question_category_difficulty_random_key')
+
+    op.drop_table('question')
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_user_score'))
@@ -0,0 +1,145 @@
+# password_hasher.py
+# bcrypt hashing and checking on a small process pool. The number of hashes in
+# flight is capped for the whole host, one per core by default: once every slot
+# has stayed taken for PASSWORD_HASH_SLOT_WAIT, callers get HasherBusy, so a burst
+# of logins can't tie up every app worker.
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+import threading
+import tempfile
+import logging
+import time
+import os
+
+import bcrypt
+
+try:
+    import fcntl
+except ImportError:  # Windows, the cap falls back to per-process
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# The one bcrypt cost factor for the whole app. Existing hashes are upgraded on login
+BCRYPT_LOG_ROUNDS = int(os.getenv('BCRYPT_LOG_ROUNDS', 12))
+HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', 2))  # Processes per app worker
+HASH_QUEUE = int(os.getenv('PASSWORD_HASH_QUEUE', os.cpu_count() or 2))  # Hashes in flight on the host
+SLOT_WAIT = float(os.getenv('PASSWORD_HASH_SLOT_WAIT', 1))  # Longest to wait for a free slot before HasherBusy
+SLOT_POLL = 0.05
+HASH_TIMEOUT = float(os.getenv('PASSWORD_HASH_TIMEOUT', 10))
+SLOT_DIR = os.getenv('PASSWORD_HASH_SLOT_DIR', tempfile.gettempdir())
+
+
+class HasherBusy(Exception):
+    """Too many hashes are in flight already, try again shortly"""
+
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def _check(password, password_hash):
+    return bcrypt.checkpw(password.encode('utf-8'), password_hash.encode('utf-8'))
+
+
+class HostSlots:
+    """A fixed number of slots shared by every worker on the host, one locked file per slot"""
+
+    def __init__(self, count, directory=SLOT_DIR):
+        self.paths = [os.path.join(directory, f"password_hash_slot_{i}") for i in range(count)]
+        self._semaphore = threading.BoundedSemaphore(count)  # Used when fcntl is missing
+
+    def acquire(self, timeout=0):
+        """Take a free slot, waiting up to timeout seconds. Returns the function that gives it back, or None"""
+        if fcntl is None:
+            return self._semaphore.release if self._semaphore.acquire(timeout=timeout) else None
+
+        deadline = time.monotonic() + timeout
+        while True:
+            release = self._try_acquire()
+            if release is not None or time.monotonic() >= deadline:
+                return release
+            time.sleep(SLOT_POLL)
+
+    def _try_acquire(self):
+        for path in self.paths:
+            f = open(path, 'a')
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                f.close()
+                continue
+            return f.close  # Closing the file drops the lock
+        return None
+
+
+class PasswordHasher:
+    def __init__(self, rounds=BCRYPT_LOG_ROUNDS, workers=HASH_WORKERS, queue=HASH_QUEUE, timeout=HASH_TIMEOUT,
+                 slot_wait=SLOT_WAIT):
+        self.rounds = rounds
+        self.workers = workers
+        self.timeout = timeout
+        self.slot_wait = slot_wait
+        self._slots = HostSlots(queue)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def hash(self, password):
+        return self._run(_hash, password, self.rounds)
+
+    def check(self, password, password_hash):
+        return self._run(_check, password, password_hash)
+
+    def needs_rehash(self, password_hash):
+        """True if the hash was made with a different cost than BCRYPT_LOG_ROUNDS"""
+        try:
+            return int(password_hash.split('$')[2]) != self.rounds
+        except (IndexError, ValueError):
+            return True
+
+    def _run(self, fn, *args):
+        release = self._slots.acquire(self.slot_wait)
+        if release is None:
+            raise HasherBusy()
+        pool = self._pool()
+        try:
+            future = pool.submit(fn, *args)
+        except BrokenProcessPool:
+            release()
+            self._discard(pool)
+            raise HasherBusy()
+        except Exception:
+            release()
+            raise
+        # The slot is held until the job is done, even if we stop waiting for it
+        future.add_done_callback(lambda _: release())
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            raise HasherBusy()
+        except BrokenProcessPool:
+            self._discard(pool)
+            raise HasherBusy()
+
+    def _discard(self, pool):
+        """Drop a pool whose process died (OOM kill, segfault), so the next hash starts a new one"""
+        with self._lock:
+            if self._executor is pool:
+                logger.error("Password hash process died, restarting the pool")
+                self._executor = None
+        pool.shutdown(wait=False)
+
+    def _pool(self):
+        # Created on first use so each app worker gets its own, after any fork. Hash
+        # processes come from a forkserver, not a fork of a worker that runs threads
+        with self._lock:
+            if self._executor is None:
+                context = None
+                if 'forkserver' in multiprocessing.get_all_start_methods():
+                    context = multiprocessing.get_context('forkserver')
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+            return self._executor
+
+
+password_hasher = PasswordHasher()
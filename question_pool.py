@@ -0,0 +1,95 @@
+# question_pool.py
+import threading
+import logging
+import os
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# The API caps limit at 50 per call
+POOL_BATCH_SIZE = int(os.getenv('QUESTION_POOL_BATCH_SIZE', 50))
+# Start a background refill once a bucket drops below this many questions
+POOL_LOW_WATER = int(os.getenv('QUESTION_POOL_LOW_WATER', 10))
+
+
+class QuestionPool:
+    """Prefetched questions kept in memory, one bucket per (category, difficulty)
+
+    fetch(category, difficulty, limit, background) returns a list of questions in the trivia
+    API's format. background is False for fills on the request path, which shouldn't wait
+    out the API's rate limit, and True for refills that can.
+    """
+
+    def __init__(self, fetch, batch_size=POOL_BATCH_SIZE, low_water=POOL_LOW_WATER):
+        self.fetch = fetch
+        self.batch_size = batch_size
+        self.low_water = low_water
+        self._buckets = {}
+        self._filling = set()  # Keys being filled inline, by a request
+        self._refilling = set()  # Keys being refilled in the background
+        self._cond = threading.Condition()
+
+    def get(self, category, difficulty):
+        """Pop one question"""
+        return self.get_many(category, difficulty, 1)[0]
+
+    def get_many(self, category, difficulty, count):
+        """Pop up to count questions, refilling inline only when the bucket can't cover them"""
+        key = (category, difficulty)
+        with self._cond:
+            bucket = self._buckets.setdefault(key, deque())
+            while len(bucket) < count:
+                # Cold bucket: one caller fetches, the rest wait for its batch. A waiter
+                # the batch didn't cover goes round again and fetches for itself. Nobody
+                # waits on a background refill, it may be sitting out the rate limit
+                if key in self._filling:
+                    self._cond.wait()
+                    continue
+                self._filling.add(key)
+                self._cond.release()
+                failed = False
+                try:
+                    self._fill(key, background=False)
+                except Exception:
+                    failed = True
+                    raise
+                finally:
+                    self._cond.acquire()
+                    self._filling.discard(key)
+                    if failed:
+                        # Leave waiting out the API's rate limit to a background refill
+                        self._start_refill(key)
+                    self._cond.notify_all()
+                break  # Serve whatever our own fetch brought in
+            if not bucket:
+                raise LookupError(f"No questions available for {category}/{difficulty}")
+            questions = [bucket.popleft() for _ in range(min(count, len(bucket)))]
+            if len(bucket) < self.low_water:
+                self._start_refill(key)
+        return questions
+
+    def size(self, category, difficulty):
+        with self._cond:
+            return len(self._buckets.get((category, difficulty), ()))
+
+    def _fill(self, key, background):
+        questions = self.fetch(key[0], key[1], self.batch_size, background)
+        with self._cond:
+            self._buckets.setdefault(key, deque()).extend(questions)
+
+    def _start_refill(self, key):
+        """Start a background refill unless one is running. Call with the lock held"""
+        if key in self._refilling or key in self._filling:
+            return
+        self._refilling.add(key)
+        threading.Thread(target=self._refill_in_background, args=(key,), daemon=True).start()
+
+    def _refill_in_background(self, key):
+        try:
+            self._fill(key, background=True)
+        except Exception as e:
+            logger.error(f"Background refill failed for {key[0]}/{key[1]}: {str(e)}")
+        finally:
+            with self._cond:
+                self._refilling.discard(key)
+                self._cond.notify_all()
@@ -0,0 +1,179 @@
+# question_snapshot.py
+# Read-only binary snapshot of the question bank, memory-mapped so every worker
+# on a host shares one page-cache copy and draws questions with no DB or network.
+#
+#   python question_snapshot.py questions.snap              # from the question table
+#   python question_snapshot.py questions.snap dump.jsonl   # from trivia API dumps
+#
+# Layout (little endian):
+#   header     magic, bucket count, record count, string table offset
+#   buckets    category ref, difficulty ref, first record, record count
+#   records    id, text, correct answer, then MAX_INCORRECT incorrect answer refs
+#   strings    u32 length + utf-8 bytes each, deduplicated
+# A ref is the string's offset in the file, NO_STRING for an unused answer slot.
+import argparse
+import logging
+import random
+import struct
+import mmap
+import sys
+import os
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'TRIVSNP1'
+HEADER = struct.Struct('<8sIII')
+BUCKET = struct.Struct('<IIII')
+MAX_INCORRECT = 3
+RECORD = struct.Struct(f'<{3 + MAX_INCORRECT}I')
+LENGTH = struct.Struct('<I')
+NO_STRING = 0xFFFFFFFF
+
+
+class QuestionSnapshot:
+    """A memory-mapped snapshot. Lookups are a struct read at a computed offset"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, bucket_count, self.record_count, _ = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a question snapshot")
+
+        # The bucket directory is tiny, so it is decoded once
+        self._buckets = {}
+        self._records_at = HEADER.size + bucket_count * BUCKET.size
+        for i in range(bucket_count):
+            category, difficulty, first, count = BUCKET.unpack_from(self._map, HEADER.size + i * BUCKET.size)
+            self._buckets[(self._string(category), self._string(difficulty))] = (first, count)
+
+    def __len__(self):
+        return self.record_count
+
+    def size(self, category, difficulty):
+        return self._buckets.get((category, difficulty), (0, 0))[1]
+
+    def random(self, category, difficulty):
+        """One random question in the trivia API's format"""
+        return self.random_batch(category, difficulty, 1)[0]
+
+    def random_batch(self, category, difficulty, limit):
+        """Up to limit distinct random questions from one bucket"""
+        first, count = self._buckets.get((category, difficulty), (0, 0))
+        if not count:
+            raise LookupError(f"No questions in the snapshot for {category}/{difficulty}")
+        picks = random.sample(range(count), min(limit, count))
+        return [self._record(first + i, category, difficulty) for i in picks]
+
+    def close(self):
+        self._map.close()
+
+    def _record(self, index, category, difficulty):
+        refs = RECORD.unpack_from(self._map, self._records_at + index * RECORD.size)
+        return {
+            'id': self._string(refs[0]),
+            'category': category,
+            'difficulty': difficulty,
+            'question': {'text': self._string(refs[1])},
+            'correctAnswer': self._string(refs[2]),
+            'incorrectAnswers': [self._string(ref) for ref in refs[3:] if ref != NO_STRING],
+        }
+
+    def _string(self, offset):
+        (length,) = LENGTH.unpack_from(self._map, offset)
+        start = offset + LENGTH.size
+        return self._map[start:start + length].decode('utf-8')
+
+
+def write_snapshot(path, rows):
+    """Write question_row() dicts to path. Returns how many questions went in"""
+    buckets = {}
+    seen = set()
+    for row in rows:
+        if row['api_id'] in seen:
+            continue
+        if len(row['incorrect_answers']) > MAX_INCORRECT:
+            logger.warning(f"Skipping question {row['api_id']}: more than {MAX_INCORRECT} incorrect answers")
+            continue
+        seen.add(row['api_id'])
+        buckets.setdefault((row['category'], row['difficulty']), []).append(row)
+
+    # Strings are placed after the fixed-size sections, so their offsets are known up front
+    record_count = len(seen)
+    strings_at = HEADER.size + len(buckets) * BUCKET.size + record_count * RECORD.size
+    string_table = bytearray()
+    offsets = {}
+
+    def ref(value):
+        if value not in offsets:
+            encoded = value.encode('utf-8')
+            offsets[value] = strings_at + len(string_table)
+            string_table.extend(LENGTH.pack(len(encoded)))
+            string_table.extend(encoded)
+        return offsets[value]
+
+    directory = bytearray()
+    records = bytearray()
+    first = 0
+    for (category, difficulty), bucket in sorted(buckets.items()):
+        directory.extend(BUCKET.pack(ref(category), ref(difficulty), first, len(bucket)))
+        for row in bucket:
+            incorrect = [ref(answer) for answer in row['incorrect_answers']]
+            incorrect += [NO_STRING] * (MAX_INCORRECT - len(incorrect))
+            records.extend(RECORD.pack(ref(row['api_id']), ref(row['text']), ref(row['correct_answer']), *incorrect))
+        first += len(bucket)
+
+    # Write next to the target and rename, so a running worker never maps a half-written file
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, len(buckets), record_count, strings_at))
+        f.write(directory)
+        f.write(records)
+        f.write(string_table)
+    os.replace(tmp_path, path)
+    return record_count
+
+
+def rows_from_bank():
+    from database import Question
+    for question in Question.query.yield_per(1000):
+        yield {
+            'api_id': question.api_id,
+            'category': question.category,
+            'difficulty': question.difficulty,
+            'text': question.text,
+            'correct_answer': question.correct_answer,
+            'incorrect_answers': list(question.incorrect_answers),
+        }
+
+
+def rows_from_dumps(paths):
+    from database import question_row
+    from import_data import iter_questions
+    for path in paths:
+        for question in iter_questions(path):
+            yield question_row(question)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export the question bank to a memory-mappable snapshot")
+    parser.add_argument('output', help="Snapshot file to write")
+    parser.add_argument('dumps', nargs='*', help=".json or .jsonl API dumps. Without any, the question table is exported")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+
+    if args.dumps:
+        written = write_snapshot(args.output, rows_from_dumps(args.dumps))
+    else:
+        from trivia_game import app
+        with app.app_context():
+            written = write_snapshot(args.output, rows_from_bank())
+
+    logger.info(f"Wrote {written} questions to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
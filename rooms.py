@@ -0,0 +1,438 @@
+# rooms.py
+# Live multiplayer rooms. Every member gets the same question at the same time,
+# pushed over Server-Sent Events. Answers are collected in memory and each round
+# is scored in one batched write, so a room costs one question fetch and one
+# write per round however many players are in it.
+#
+# Each stream holds a connection open, so serve rooms from async_app (gevent).
+# RoomManager keeps rooms in one process's memory, for local dev. SharedRoomManager
+# keeps them in Redis/Valkey and fans events out over pub/sub, so a room's players
+# can be spread over any number of workers and containers.
+import threading
+import logging
+import secrets
+import queue
+import json
+import time
+import os
+
+import redis
+
+from answer_token import shuffle_answers
+
+logger = logging.getLogger(__name__)
+
+ROUND_SECONDS = float(os.getenv('ROOM_ROUND_SECONDS', 15))
+BREAK_SECONDS = float(os.getenv('ROOM_BREAK_SECONDS', 5))
+KEEPALIVE_SECONDS = 15
+ROOM_TTL = 3600  # A room nobody is in is dropped after this long
+
+
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class Room:
+    def __init__(self, category, difficulty):
+        self.id = secrets.token_urlsafe(6)
+        self.category = category
+        self.difficulty = difficulty
+        self.members = {}  # user_id -> username
+        self.subscribers = {}  # user_id -> queue of SSE messages
+        self.round = 0
+        self.question = None
+        self.answers = {}  # user_id -> answer, for the current round
+        self.lock = threading.Lock()
+        self.thread = None
+        self.created_at = time.monotonic()
+
+    def broadcast(self, event, data):
+        message = sse(event, data)
+        with self.lock:
+            subscribers = list(self.subscribers.values())
+        for q in subscribers:
+            q.put(message)
+
+
+class RoomManager:
+    """draw_question(category, difficulty) gives one question in the trivia API's format.
+    score_round(room, question, results) persists a round, results is [(user_id, correct)]."""
+
+    def __init__(self, app, draw_question, score_round):
+        self.app = app
+        self.draw_question = draw_question
+        self.score_round = score_round
+        self.rooms = {}
+        self._lock = threading.Lock()
+
+    def create(self, category, difficulty):
+        room = Room(category, difficulty)
+        with self._lock:
+            self._expire()
+            self.rooms[room.id] = room
+        return room
+
+    def get(self, room_id):
+        return self.rooms.get(room_id)
+
+    def listing(self):
+        with self._lock:
+            self._expire()
+            return list(self.rooms.values())
+
+    def _expire(self):
+        """Drop rooms nobody joined within ROOM_TTL. Call with the lock held"""
+        cutoff = time.monotonic() - ROOM_TTL
+        for room_id, room in list(self.rooms.items()):
+            if room.created_at < cutoff and not room.subscribers:
+                del self.rooms[room_id]
+
+    def subscribe(self, room, user_id, username):
+        q = queue.Queue()
+        with room.lock:
+            room.members[user_id] = username
+            room.subscribers[user_id] = q
+            # The first listener starts the rounds
+            if room.thread is None or not room.thread.is_alive():
+                room.thread = threading.Thread(target=self._play, args=(room,), daemon=True)
+                room.thread.start()
+            current = self._question_event(room) if room.question else None
+        room.broadcast('members', sorted(room.members.values()))
+        if current:
+            q.put(sse('question', current))
+        return q
+
+    def unsubscribe(self, room, user_id):
+        with room.lock:
+            room.subscribers.pop(user_id, None)
+            room.members.pop(user_id, None)
+            empty = not room.subscribers
+        if empty:
+            with self._lock:
+                self.rooms.pop(room.id, None)
+        else:
+            room.broadcast('members', sorted(room.members.values()))
+
+    def stream(self, room, user_id, username):
+        """SSE generator for one member"""
+        q = self.subscribe(room, user_id, username)
+        try:
+            while True:
+                try:
+                    yield q.get(timeout=KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+        finally:
+            self.unsubscribe(room, user_id)
+
+    def answer(self, room, user_id, round_no, answer):
+        """Record a member's first answer for the current round. Returns False if it's too late"""
+        with room.lock:
+            if user_id not in room.members or round_no != room.round or room.question is None:
+                return False
+            room.answers.setdefault(user_id, answer)
+            return True
+
+    def _question_event(self, room):
+        return {'round': room.round, 'question': room.question['question']['text'],
+                'answers': room.question['shuffled'], 'seconds': ROUND_SECONDS}
+
+    def _play(self, room):
+        while room.subscribers:
+            try:
+                with self.app.app_context():
+                    question = self.draw_question(room.category, room.difficulty)
+            except Exception as e:
+                logger.error(f"Room {room.id} could not get a question: {str(e)}")
+                time.sleep(BREAK_SECONDS)
+                continue
+
+            answers, _ = shuffle_answers(question)
+            with room.lock:
+                room.round += 1
+                room.question = dict(question, shuffled=answers)
+                room.answers = {}
+                event = self._question_event(room)
+            room.broadcast('question', event)
+
+            time.sleep(ROUND_SECONDS)
+
+            with room.lock:
+                answered, room.answers = room.answers, {}
+                room.question = None
+                names = dict(room.members)
+            results = [(user_id, answer == question['correctAnswer']) for user_id, answer in answered.items()]
+            if results:
+                try:
+                    with self.app.app_context():
+                        self.score_round(room, question, results)
+                except Exception as e:
+                    logger.error(f"Room {room.id} could not save round {room.round}: {str(e)}")
+
+            room.broadcast('result', {
+                'round': room.round,
+                'correctAnswer': question['correctAnswer'],
+                'correct': sorted(names.get(user_id, '?') for user_id, ok in results if ok),
+            })
+            time.sleep(BREAK_SECONDS)
+
+
+#------ Shared rooms ------#
+# Keys, for room <id>:
+#   rooms                    set of open room ids
+#   room:<id>                hash: category, difficulty, round, open, event (the current question)
+#   room:<id>:members        sorted set: user id -> last seen, so a dead worker's members age out
+#   room:<id>:names          hash: user id -> username
+#   room:<id>:answers        hash: user id -> answer, for the current round
+#   room:<id>:driver         the worker running the room's rounds
+#   room-events:<id>         pub/sub channel carrying the room's SSE messages
+
+MEMBER_TIMEOUT = KEEPALIVE_SECONDS * 3  # Members not seen for this long are dropped
+DRIVER_TTL = int(ROUND_SECONDS + BREAK_SECONDS + KEEPALIVE_SECONDS)
+CHANNEL = 'room-events:'
+
+
+class SharedRoom:
+    """A room as read back from Redis. members is user id -> username"""
+
+    def __init__(self, id, category, difficulty, members=None):
+        self.id = id
+        self.category = category
+        self.difficulty = difficulty
+        self.members = members or {}
+
+
+class SharedRoomManager:
+    """RoomManager with room state in Redis, for several workers.
+
+    One worker at a time holds a room's driver key and runs its rounds. Any worker with
+    a member in the room takes over if that worker dies. Every worker holds one pub/sub
+    connection and passes each room's events on to the streams it is serving."""
+
+    def __init__(self, app, url, draw_question, score_round):
+        self.app = app
+        self.redis = redis.Redis.from_url(url, decode_responses=True)
+        self.draw_question = draw_question
+        self.score_round = score_round
+        self.token = secrets.token_hex(8)  # Identifies this worker as a room's driver
+        self._local = {}  # room id -> {user id: queue of SSE messages}, streams in this worker
+        self._pubsub = None
+        self._lock = threading.Lock()
+
+    def create(self, category, difficulty):
+        room = SharedRoom(secrets.token_urlsafe(6), category, difficulty)
+        key = f"room:{room.id}"
+        pipe = self.redis.pipeline()
+        pipe.hset(key, mapping={'category': category, 'difficulty': difficulty, 'round': 0, 'open': 0})
+        pipe.expire(key, ROOM_TTL)
+        pipe.sadd('rooms', room.id)
+        pipe.execute()
+        return room
+
+    def get(self, room_id):
+        pipe = self.redis.pipeline()
+        pipe.hmget(f"room:{room_id}", 'category', 'difficulty')
+        pipe.hgetall(f"room:{room_id}:names")
+        (category, difficulty), names = pipe.execute()
+        if category is None:
+            return None
+        return SharedRoom(room_id, category, difficulty, names)
+
+    def listing(self):
+        room_ids = sorted(self.redis.smembers('rooms'))
+        pipe = self.redis.pipeline()
+        for room_id in room_ids:
+            pipe.hmget(f"room:{room_id}", 'category', 'difficulty')
+            pipe.hgetall(f"room:{room_id}:names")
+        results = pipe.execute()
+        rooms, expired = [], []
+        for i, room_id in enumerate(room_ids):
+            (category, difficulty), names = results[2 * i], results[2 * i + 1]
+            if category is None:
+                expired.append(room_id)
+            else:
+                rooms.append(SharedRoom(room_id, category, difficulty, names))
+        if expired:
+            self.redis.srem('rooms', *expired)
+        return rooms
+
+    def subscribe(self, room, user_id, username):
+        q = queue.Queue()
+        with self._lock:
+            self._listen()
+            self._local.setdefault(room.id, {})[user_id] = q
+        pipe = self.redis.pipeline()
+        pipe.zadd(f"room:{room.id}:members", {user_id: time.time()})
+        pipe.hset(f"room:{room.id}:names", user_id, username)
+        pipe.expire(f"room:{room.id}:members", ROOM_TTL)
+        pipe.expire(f"room:{room.id}:names", ROOM_TTL)
+        pipe.hget(f"room:{room.id}", 'event')
+        current = pipe.execute()[-1]
+        self._drive(room.id)
+        self._publish_members(room.id)
+        if current:
+            q.put(sse('question', json.loads(current)))
+        return q
+
+    def unsubscribe(self, room, user_id):
+        with self._lock:
+            local = self._local.get(room.id, {})
+            local.pop(user_id, None)
+            if not local:
+                self._local.pop(room.id, None)
+        pipe = self.redis.pipeline()
+        pipe.zrem(f"room:{room.id}:members", user_id)
+        pipe.hdel(f"room:{room.id}:names", user_id)
+        pipe.zcard(f"room:{room.id}:members")
+        if pipe.execute()[-1] == 0:
+            self._close(room.id)
+        else:
+            self._publish_members(room.id)
+
+    def stream(self, room, user_id, username):
+        """SSE generator for one member"""
+        q = self.subscribe(room, user_id, username)
+        seen_at = time.monotonic()
+        try:
+            while True:
+                try:
+                    yield q.get(timeout=KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                if time.monotonic() - seen_at >= KEEPALIVE_SECONDS:
+                    seen_at = time.monotonic()
+                    self.redis.zadd(f"room:{room.id}:members", {user_id: time.time()})
+                    self._drive(room.id)  # Take over if the room's driver has gone
+        finally:
+            self.unsubscribe(room, user_id)
+
+    def answer(self, room, user_id, round_no, answer):
+        """Record a member's first answer for the current round. Returns False if it's too late"""
+        key = f"room:{room.id}"
+        # The driver closes a round by writing to the room hash, so an answer either
+        # lands before the close or the transaction fails
+        with self.redis.pipeline() as pipe:
+            try:
+                pipe.watch(key)
+                current, is_open = pipe.hmget(key, 'round', 'open')
+                if is_open != '1' or current != str(round_no):
+                    return False
+                if pipe.zscore(f"room:{room.id}:members", user_id) is None:
+                    return False
+                pipe.multi()
+                pipe.hsetnx(f"room:{room.id}:answers", user_id, '' if answer is None else str(answer))
+                pipe.execute()
+                return True
+            except redis.WatchError:
+                return False
+
+    def _listen(self):
+        """Subscribe this worker to every room's events. Call with the lock held"""
+        if self._pubsub is not None:
+            return
+        # Subscribed before the thread starts, so the caller's first publish isn't missed
+        self._pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        self._pubsub.psubscribe(f"{CHANNEL}*")
+        threading.Thread(target=self._relay, daemon=True).start()
+
+    def _relay(self):
+        while True:
+            try:
+                for message in self._pubsub.listen():
+                    room_id = message['channel'][len(CHANNEL):]
+                    with self._lock:
+                        queues = list(self._local.get(room_id, {}).values())
+                    for q in queues:
+                        q.put(message['data'])
+            except Exception as e:
+                logger.error(f"Room events connection failed: {str(e)}")
+                time.sleep(1)  # The next listen() reconnects and resubscribes
+
+    def _publish(self, room_id, event, data):
+        self.redis.publish(f"{CHANNEL}{room_id}", sse(event, data))
+
+    def _publish_members(self, room_id):
+        self._publish(room_id, 'members', sorted(self.redis.hvals(f"room:{room_id}:names")))
+
+    def _close(self, room_id):
+        self.redis.delete(f"room:{room_id}", f"room:{room_id}:members", f"room:{room_id}:names",
+                          f"room:{room_id}:answers")
+        self.redis.srem('rooms', room_id)
+
+    def _drive(self, room_id):
+        """Start the room's rounds in this worker unless another worker is running them"""
+        if self.redis.set(f"room:{room_id}:driver", self.token, nx=True, ex=DRIVER_TTL):
+            threading.Thread(target=self._play, args=(room_id,), daemon=True).start()
+
+    def _still_driving(self, room_id):
+        """Renew our hold on the room's rounds. False if the room is empty or another worker took over"""
+        key = f"room:{room_id}:driver"
+        if self.redis.get(key) != self.token:
+            return False
+        self.redis.expire(key, DRIVER_TTL)
+
+        members = f"room:{room_id}:members"
+        stale = self.redis.zrangebyscore(members, 0, time.time() - MEMBER_TIMEOUT)
+        if stale:
+            self.redis.zrem(members, *stale)
+            self.redis.hdel(f"room:{room_id}:names", *stale)
+            self._publish_members(room_id)
+        if self.redis.zcard(members) == 0:
+            self._close(room_id)
+            return False
+        return True
+
+    def _play(self, room_id):
+        key = f"room:{room_id}"
+        try:
+            room = self.get(room_id)
+            while room is not None and self._still_driving(room_id):
+                try:
+                    with self.app.app_context():
+                        question = self.draw_question(room.category, room.difficulty)
+                except Exception as e:
+                    logger.error(f"Room {room_id} could not get a question: {str(e)}")
+                    time.sleep(BREAK_SECONDS)
+                    continue
+
+                answers, _ = shuffle_answers(question)
+                round_no = self.redis.hincrby(key, 'round', 1)
+                event = {'round': round_no, 'question': question['question']['text'],
+                         'answers': answers, 'seconds': ROUND_SECONDS}
+                pipe = self.redis.pipeline()
+                pipe.delete(f"{key}:answers")
+                pipe.hset(key, mapping={'open': 1, 'event': json.dumps(event)})
+                for suffix in ('', ':members', ':names'):
+                    pipe.expire(f"{key}{suffix}", ROOM_TTL)
+                pipe.execute()
+                self._publish(room_id, 'question', event)
+
+                time.sleep(ROUND_SECONDS)
+
+                pipe = self.redis.pipeline()
+                pipe.hset(key, 'open', 0)
+                pipe.hdel(key, 'event')
+                pipe.hgetall(f"{key}:answers")
+                pipe.delete(f"{key}:answers")
+                pipe.hgetall(f"{key}:names")
+                _, _, answered, _, names = pipe.execute()
+                results = [(int(user_id), answer == question['correctAnswer']) for user_id, answer in answered.items()]
+                if results:
+                    try:
+                        with self.app.app_context():
+                            self.score_round(room, question, results)
+                    except Exception as e:
+                        logger.error(f"Room {room_id} could not save round {round_no}: {str(e)}")
+
+                self._publish(room_id, 'result', {
+                    'round': round_no,
+                    'correctAnswer': question['correctAnswer'],
+                    'correct': sorted(names.get(str(user_id), '?') for user_id, ok in results if ok),
+                })
+                time.sleep(BREAK_SECONDS)
+        except Exception as e:
+            logger.error(f"Room {room_id} stopped: {str(e)}")
+        finally:
+            # Let another worker pick the room up straight away, if it still has members
+            if self.redis.get(f"room:{room_id}:driver") == self.token:
+                self.redis.delete(f"room:{room_id}:driver")
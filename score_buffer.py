@@ -0,0 +1,68 @@
+# score_buffer.py
+# Write-behind score updates: increments are summed in memory per user and flushed
+# as one batched UPDATE every few seconds, so DB writes follow the flush interval
+# instead of the answer rate.
+import threading
+import logging
+import atexit
+import time
+import os
+
+from database import add_scores
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = float(os.getenv('SCORE_FLUSH_INTERVAL', 2))
+
+
+class ScoreBuffer:
+    def __init__(self, app, interval=FLUSH_INTERVAL):
+        self.app = app
+        self.interval = interval
+        self._pending = {}  # (user_id, category, difficulty) -> points
+        self._totals = {}  # user_id -> points, so pending() is a dict lookup
+        self._lock = threading.Lock()
+        self._thread = None
+        atexit.register(self.flush)
+
+    def add(self, user_id, points, category, difficulty):
+        key = (user_id, category, difficulty)
+        with self._lock:
+            self._pending[key] = self._pending.get(key, 0) + points
+            self._totals[user_id] = self._totals.get(user_id, 0) + points
+            # Started on first use so it runs in the worker, not a preforked parent
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def pending(self, user_id):
+        """Points added for this user that are not in the database yet"""
+        with self._lock:
+            return self._totals.get(user_id, 0)
+
+    def flush(self):
+        with self._lock:
+            increments, self._pending = self._pending, {}
+        if not increments:
+            return
+        try:
+            with self.app.app_context():
+                add_scores(increments)
+        except Exception as e:
+            logger.error(f"Score flush failed, keeping {len(increments)} increments for the next one: {str(e)}")
+            with self._lock:
+                for key, points in increments.items():
+                    self._pending[key] = self._pending.get(key, 0) + points
+            return
+
+        # Only now are the points in the database, so pending() never drops them early
+        with self._lock:
+            for (user_id, _, _), points in increments.items():
+                self._totals[user_id] -= points
+                if not self._totals[user_id]:
+                    del self._totals[user_id]
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.flush()
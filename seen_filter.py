@@ -0,0 +1,46 @@
+# seen_filter.py
+# A Bloom filter over question ids, one per player, stored in the seen_questions
+# table so it doesn't ride along with every session read and write. Membership is
+# a few bit lookups no matter how many questions the player has seen. False
+# positives only mean an unseen question is occasionally skipped.
+import hashlib
+import os
+
+SEEN_FILTER_BITS = int(os.getenv('SEEN_FILTER_BITS', 16384))  # 2 KB
+SEEN_FILTER_HASHES = 4
+# Start over past this many ids, when false positives would pass ~2%
+SEEN_FILTER_CAPACITY = int(os.getenv('SEEN_FILTER_CAPACITY', 2000))
+
+
+class SeenFilter:
+    def __init__(self, bits=SEEN_FILTER_BITS, data=None, count=0):
+        self.bits = bits
+        self.data = bytearray(data) if data else bytearray(bits // 8)
+        self.count = count
+
+    def _positions(self, question_id):
+        digest = hashlib.blake2b(str(question_id).encode('utf-8'), digest_size=4 * SEEN_FILTER_HASHES).digest()
+        for i in range(SEEN_FILTER_HASHES):
+            yield int.from_bytes(digest[4 * i:4 * i + 4], 'little') % self.bits
+
+    def __contains__(self, question_id):
+        return all(self.data[p >> 3] & (1 << (p & 7)) for p in self._positions(question_id))
+
+    def add(self, question_id):
+        if self.count >= SEEN_FILTER_CAPACITY:
+            # Forget everything rather than let the filter fill up
+            self.data = bytearray(self.bits // 8)
+            self.count = 0
+        for p in self._positions(question_id):
+            self.data[p >> 3] |= 1 << (p & 7)
+        self.count += 1
+
+    def dump(self):
+        """The filter's bits, for a SeenQuestions row"""
+        return bytes(self.data)
+
+    @classmethod
+    def load(cls, data, count):
+        if not data:
+            return cls()
+        return cls(bits=len(data) * 8, data=data, count=count)
@@ -0,0 +1,93 @@
+# static_assets.py
+# Long-lived caching for files under static/: content-hashed URLs, immutable cache
+# headers, and gzip/brotli copies built ahead of time with `flask compress-assets`.
+import mimetypes
+import hashlib
+import gzip
+import os
+
+from flask import request, send_from_directory
+from werkzeug.security import safe_join
+
+ONE_YEAR = 365 * 24 * 3600
+COMPRESSIBLE = ('.css', '.js', '.svg', '.html', '.json', '.txt')
+# Preferred first
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def init_static_assets(app):
+    hashes = {}
+
+    def asset_hash(filename):
+        if filename not in hashes:
+            path = safe_join(app.static_folder, filename)
+            try:
+                with open(path, 'rb') as f:
+                    hashes[filename] = hashlib.sha256(f.read()).hexdigest()[:12]
+            except (OSError, TypeError):  # Missing, or outside static/ (safe_join gave None)
+                return None  # Not cached, so unknown names from clients can't grow the dict
+        return hashes[filename]
+
+    def precompressed(filename, suffix):
+        """True if a .gz/.br copy exists and isn't older than the file, i.e. compress-assets ran since the last edit"""
+        path = os.path.join(app.static_folder, filename)
+        try:
+            return os.path.getmtime(path + suffix) >= os.path.getmtime(path)
+        except OSError:
+            return False
+
+    @app.url_defaults
+    def fingerprint_static_urls(endpoint, values):
+        # url_for('static', filename=...) becomes /static/...?v=<content hash>
+        if endpoint == 'static' and 'filename' in values and 'v' not in values:
+            digest = asset_hash(values['filename'])
+            if digest:
+                values['v'] = digest
+
+    def static(filename):
+        # The URL changes whenever the content does, so a fingerprinted file can be cached forever.
+        # Only if the hash is this file's, though: mid-deploy, new HTML can ask an old worker
+        # for the new hash. Otherwise leave it to send_from_directory's default (no-cache,
+        # revalidate with the ETag)
+        version = request.args.get('v')
+        max_age = ONE_YEAR if version and version == asset_hash(filename) else None
+        for encoding, suffix in ENCODINGS:
+            # Quality lookup, so 'gzip;q=0' counts as refused
+            if request.accept_encodings[encoding] and precompressed(filename, suffix):
+                response = send_from_directory(app.static_folder, filename + suffix, max_age=max_age,
+                                               mimetype=mimetypes.guess_type(filename)[0])
+                response.headers['Content-Encoding'] = encoding
+                break
+        else:
+            response = send_from_directory(app.static_folder, filename, max_age=max_age)
+        response.vary.add('Accept-Encoding')
+
+        if max_age:
+            response.cache_control.no_cache = None
+            response.cache_control.public = True
+            response.cache_control.immutable = True
+        return response
+
+    app.view_functions['static'] = static
+
+    @app.cli.command('compress-assets')
+    def compress_assets():
+        """Write .gz (and .br if brotli is installed) copies of static files"""
+        try:
+            import brotli  # Only this command needs it, so it isn't imported at boot
+        except ImportError:  # Brotli is optional, gzip still works without it
+            brotli = None
+
+        for root, _, files in os.walk(app.static_folder):
+            for name in files:
+                if not name.endswith(COMPRESSIBLE):
+                    continue
+                path = os.path.join(root, name)
+                with open(path, 'rb') as f:
+                    data = f.read()
+                with open(path + '.gz', 'wb') as f:
+                    f.write(gzip.compress(data, compresslevel=9, mtime=0))
+                if brotli:
+                    with open(path + '.br', 'wb') as f:
+                        f.write(brotli.compress(data, quality=11))
+                print(f"Compressed {os.path.relpath(path, app.static_folder)}")
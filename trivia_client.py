@@ -0,0 +1,200 @@
+# trivia_client.py
+# Shared HTTP client for the-trivia-api: pooled keep-alive connections, timeouts,
+# rate limit pacing shared by every worker on the host, and a circuit breaker.
+import threading
+import tempfile
+import logging
+import time
+import os
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import UPSTREAM_SECONDS, UPSTREAM_RESPONSES, UPSTREAM_RATE_LIMITED
+
+try:
+    import fcntl
+except ImportError:  # Windows, pacing falls back to per-process
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+TRIVIA_API_URL = os.getenv('TRIVIA_API_URL', "https://the-trivia-api.com/v2/questions")
+CONNECT_TIMEOUT = float(os.getenv('TRIVIA_API_CONNECT_TIMEOUT', 3))
+READ_TIMEOUT = float(os.getenv('TRIVIA_API_READ_TIMEOUT', 5))
+POOL_SIZE = int(os.getenv('TRIVIA_API_POOL_SIZE', 10))
+
+# The API allows one request per 5 seconds
+RATE_PER_SECOND = float(os.getenv('TRIVIA_API_RATE', 0.2))
+BURST = float(os.getenv('TRIVIA_API_BURST', 1))
+MAX_WAIT = float(os.getenv('TRIVIA_API_MAX_WAIT', 10))  # Longest a background refill will wait for a token
+# A request filling a cold bucket doesn't wait, it falls back to the bank instead
+INLINE_MAX_WAIT = float(os.getenv('TRIVIA_API_INLINE_MAX_WAIT', 0))
+# ...unless the bank has nothing for it either (e.g. a fresh deploy), then it waits up to one token interval
+COLD_MAX_WAIT = float(os.getenv('TRIVIA_API_COLD_MAX_WAIT', min(MAX_WAIT, 1 / RATE_PER_SECOND)))
+BUCKET_FILE = os.getenv('TRIVIA_API_BUCKET_FILE', os.path.join(tempfile.gettempdir(), 'trivia_api_bucket'))
+
+FAILURE_THRESHOLD = int(os.getenv('TRIVIA_API_FAILURE_THRESHOLD', 5))
+RESET_TIMEOUT = float(os.getenv('TRIVIA_API_RESET_TIMEOUT', 30))
+
+
+class UpstreamError(Exception):
+    """The trivia API could not give us questions"""
+
+
+class UpstreamUnavailable(UpstreamError):
+    """Failing fast: the circuit is open or no rate limit token came in time"""
+
+
+class TokenBucket:
+    """Token bucket whose state lives in a locked file, so all workers on a host share it"""
+
+    def __init__(self, rate=RATE_PER_SECOND, capacity=BURST, path=BUCKET_FILE):
+        self.rate = rate
+        self.capacity = capacity
+        self.path = path
+        self._lock = threading.Lock()
+        self._state = (capacity, time.time())  # Used when fcntl is missing
+
+    def acquire(self, max_wait=MAX_WAIT):
+        """Take one token, sleeping up to max_wait seconds for it. Returns False on timeout"""
+        deadline = time.monotonic() + max_wait
+        while True:
+            wait = self._try_take()
+            if wait == 0:
+                return True
+            if time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+    def _try_take(self):
+        """Take a token if one is there, otherwise return how long until there is one"""
+        with self._lock:
+            if fcntl is None:
+                tokens, wait = self._take(*self._state)
+                return wait
+
+            with open(self.path, 'a+') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    f.seek(0)
+                    try:
+                        tokens, stamp = (float(x) for x in f.read().split())
+                    except ValueError:
+                        tokens, stamp = self.capacity, time.time()
+                    tokens, wait = self._take(tokens, stamp)
+                    f.seek(0)
+                    f.truncate()
+                    f.write(f"{tokens} {time.time()}")
+                    return wait
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _take(self, tokens, stamp):
+        now = time.time()
+        tokens = min(self.capacity, tokens + (now - stamp) * self.rate)
+        if tokens >= 1:
+            tokens -= 1
+            wait = 0
+        else:
+            wait = (1 - tokens) / self.rate
+        self._state = (tokens, now)
+        return tokens, wait
+
+
+class CircuitBreaker:
+    """Open after a run of failures, then let one trial call through once reset_timeout has passed"""
+
+    def __init__(self, failure_threshold=FAILURE_THRESHOLD, reset_timeout=RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half_open'
+        return 'open'
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half_open' and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def release(self):
+        """Give back a trial call that never reached the upstream"""
+        with self._lock:
+            self._trial_running = False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_running = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    logger.warning("Trivia API circuit opened after repeated failures")
+                self.opened_at = time.monotonic()
+
+
+class TriviaClient:
+    def __init__(self, base_url=TRIVIA_API_URL, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT),
+                 bucket=None, breaker=None):
+        self.base_url = base_url
+        self.timeout = timeout
+        self.bucket = bucket or TokenBucket()
+        self.breaker = breaker or CircuitBreaker()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def fetch_questions(self, category, difficulty, limit, max_wait=MAX_WAIT):
+        """Pull a batch of questions for one category and difficulty, waiting up to max_wait for a rate limit token"""
+        if not self.breaker.allow():
+            raise UpstreamUnavailable("Trivia API circuit is open")
+        if not self.bucket.acquire(max_wait):
+            self.breaker.release()
+            raise UpstreamUnavailable("No trivia API rate limit token came in time")
+
+        params = {"categories": category, "difficulties": difficulty, "limit": limit}
+        started = time.perf_counter()
+        try:
+            response = self.session.get(self.base_url, params=params, timeout=self.timeout)
+        except requests.RequestException as e:
+            self.breaker.record_failure()
+            UPSTREAM_RESPONSES.labels('error').inc()
+            raise UpstreamError(f"Trivia API request failed: {str(e)}") from e
+        finally:
+            UPSTREAM_SECONDS.observe(time.perf_counter() - started)
+
+        UPSTREAM_RESPONSES.labels(response.status_code).inc()
+        if response.status_code == 429:
+            UPSTREAM_RATE_LIMITED.inc()
+
+        # Lazy %-formatting, and sampled so it can be thinned out under load
+        logger.info("Request: %s %s | Status_Code: %s | Elapsed: %.3fs",
+                    response.request.method, response.url, response.status_code,
+                    response.elapsed.total_seconds(),
+                    extra={'sampled': True, 'status_code': response.status_code})
+        if response.status_code != 200:
+            self.breaker.record_failure()
+            raise UpstreamError(f"Trivia API returned {response.status_code}")
+
+        self.breaker.record_success()
+        return response.json()
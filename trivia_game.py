@@ -1,27 +1,40 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash
+from flask import Flask, render_template, request, redirect, url_for, session, flash, make_response, Response, abort, jsonify
 from dotenv import load_dotenv
 #from google.cloud import secretmanager
 #from google.auth import credentials
 #from google_auth_oauthlib.flow import Flow
-from database import db, User
+from database import db, User, Question, PlayerStats, SeenQuestions, save_questions, save_seen, add_score, add_scores
+from score_buffer import ScoreBuffer
+from leaderboard import Leaderboard
+from user_cache import UserCache
+from answer_log import AnswerLog
+from answer_token import AnswerTokens, InvalidToken, new_nonce
+from seen_filter import SeenFilter
+from rooms import RoomManager, SharedRoomManager
+from logging_setup import configure_logging
+from password_hasher import HasherBusy
+from static_assets import init_static_assets
+from metrics import init_metrics
+from question_pool import QuestionPool
+from question_snapshot import QuestionSnapshot
+from trivia_client import TriviaClient, UpstreamError, UpstreamUnavailable, MAX_WAIT, INLINE_MAX_WAIT, COLD_MAX_WAIT
 from flask_login import LoginManager, login_user, logout_user, current_user
-from flask_bcrypt import Bcrypt
-from flask_migrate import Migrate
 from flask_session import Session
-from datetime import timedelta
+from datetime import timedelta, datetime, timezone
+from functools import wraps
 from flask_wtf import FlaskForm
 from wtforms import StringField, PasswordField, SubmitField
 from wtforms.validators import InputRequired
 from flask_limiter import Limiter
+from flask_limiter.util import get_remote_address
+from werkzeug.middleware.proxy_fix import ProxyFix
 
-import requests
-import random
-import time
 import logging
-import json
 import os
-import re
 import secrets
+import hashlib
+import math
+import time
 
 # Load environment variables from .env file
 load_dotenv()
@@ -29,24 +42,35 @@ load_dotenv()
 app = Flask(__name__)
 app.secret_key = os.getenv('FLASK_SECRET_KEY')
 
-# Set up Flask-Login and Flask-Bcrypt
-bcrypt = Bcrypt(app)
+# Behind a proxy (Railway's router, a load balancer) remote_addr is the proxy's, so per-IP
+# rate limits would be site-wide. Trust X-Forwarded-For/-Proto from this many proxies in front
+TRUSTED_PROXY_HOPS = int(os.getenv('TRUSTED_PROXY_HOPS', 0))
+if TRUSTED_PROXY_HOPS:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_HOPS, x_proto=TRUSTED_PROXY_HOPS)
+
+# Set up Flask-Login (bcrypt runs in password_hasher's process pool)
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'index'
 
-app.config['SESSION_COOKIE_SECURE'] = True  # Ensure cookies are only sent over HTTPS
+app.config['SESSION_COOKIE_SECURE'] = os.getenv('SESSION_COOKIE_SECURE', 'true').lower() == 'true'  # Ensure cookies are only sent over HTTPS
 app.config['SESSION_COOKIE_HTTPONLY'] = True  # Prevent JavaScript access to cookies
 app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'  # Protect against CSRF attacks
-app.config['SESSION_TYPE'] = 'filesystem'  # Stores sessions on disk
+# Session storage: 'filesystem' (one host only), 'sqlalchemy' (a table in our database) or 'redis'
+app.config['SESSION_TYPE'] = os.getenv('SESSION_BACKEND', 'filesystem')
+if app.config['SESSION_TYPE'] == 'sqlalchemy':
+    app.config['SESSION_SQLALCHEMY'] = db
+    app.config['SESSION_SQLALCHEMY_TABLE'] = 'sessions'
+elif app.config['SESSION_TYPE'] == 'redis':
+    import redis
+    app.config['SESSION_REDIS'] = redis.from_url(os.getenv('SESSION_REDIS_URL', 'redis://localhost:6379/0'))  # Redis expires keys itself
+app.config['SESSION_CLEANUP_N_REQUESTS'] = int(os.getenv('SESSION_CLEANUP_N_REQUESTS', 1000))  # Sweep expired sessions every N requests
 app.config['SESSION_USE_SIGNER'] = True  # Prevents tampering
 app.config['SESSION_PERMANENT'] = True # Keeps sessions
 app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(minutes=30) # But only for 30 mins
 app.config['SECRET_KEY'] = os.getenv('FLASK_SECRET_KEY')
 app.config['WTF_CSRF_ENABLED'] = True 
 
-Session(app)
-
 # CSRF Protection
 #csrf = CSRFProtect(app)
 
@@ -54,10 +78,20 @@ login_manager.session_protection = "strong"  # Use strong protection for session
 
 #------ This is the database section -----#
 
-# Load user from the db
+# Users are cached per process, so most requests don't query for them at all
+user_cache = UserCache()
+
+# Load user from the cache, or the db on a miss
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))  # Get the user by ID from the database
+    user_id = int(user_id)
+    user = user_cache.get(user_id)
+    if user is None:
+        user = db.session.get(User, user_id)  # Get the user by ID from the database
+        if user is None:
+            return None
+        user = user_cache.put(user)
+    return user
 
 # Load database URL from environment # Change the env when deploying to dev
 app.config["SQLALCHEMY_DATABASE_URI"] = os.getenv("DATABASE_PUBLIC_URL") 
@@ -66,54 +100,206 @@ app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 
 # Initialize the database with the app
 db.init_app(app)
-migrate = Migrate(app, db)
+
+# Flask-Migrate pulls in Alembic, which only the `flask db` commands need.
+# gunicorn.conf.py sets FAST_BOOT so serving workers skip it
+if os.getenv('FAST_BOOT', 'false').lower() != 'true':
+    from flask_migrate import Migrate
+    migrate = Migrate(app, db)
+
+# Sessions come after the database, the sqlalchemy backend needs it
+Session(app)
+
+# Fingerprinted, long-cached and precompressed static files
+init_static_assets(app)
+
+# Per-route latency, DB, template, session and upstream timings at /metrics
+init_metrics(app, db)
 
 #------ END OF DB FUNCTIONS ------#
 
 
-# Set up logging
+# Set up logging (masking, sampling and the optional queue live in logging_setup)
+configure_logging()
 logger = logging.getLogger(__name__)
 
-class MaskSensitiveData(logging.Filter):
-    def filter(self, record):
-        record.msg = self.mask_tokens(str(record.msg))
-        return True
-
-    def mask_tokens(self, log_message):
-        # Define multiple regex patterns for different sensitive fields
-        patterns = [
-            (r'(access_token=)[^\s]+', r'\1****'),  # Mask access tokens
-            (r'(id_token=)[^\s]+', r'\1****'),      # Mask ID tokens
-            (r'(refresh_token=)[^\s]+', r'\1****'), # Mask refresh tokens
-            (r'(Authorization: Bearer )\S+', r'\1****'), # Mask Authorization headers
-            (r'(client_secret=)[^\s]+', r'\1****'), # Mask OAuth client secrets
-            (r'(code=)[^\s]+', r'\1****'),         # Mask auth codes from OAuth
-        ]
-
-        # Apply each pattern to mask sensitive data
-        for pattern, replacement in patterns:
-            log_message = re.sub(pattern, replacement, log_message, flags=re.IGNORECASE)
-
-        return log_message
-
-# Apply the filter to your logger
-#logger.setLevel(logging.DEBUG)  # Keep debug mode on
-mask_filter = MaskSensitiveData()
-
-# Apply filter to all handlers
-for handler in logger.handlers:
-    handler.addFilter(mask_filter)
-
-# If no handlers exist, create one
-#if not logger.hasHandlers():
-#    console_handler = logging.StreamHandler()
-#    console_handler.setLevel(logging.DEBUG)
-#    console_handler.addFilter(mask_filter)
-#    logger.addHandler(console_handler)
 
-    
-# Initialize the players' score
-player_score = {}
+# Questions per round in round mode
+ROUND_SIZES = (1, 5, 10)
+
+# Points per correct answer
+POINTS = {'easy': 1, 'medium': 2, 'hard': 3}
+
+# 'direct' writes every score change with one atomic UPDATE, 'writebehind' batches them
+SCORE_WRITE_MODE = os.getenv('SCORE_WRITE_MODE', 'direct')
+score_buffer = ScoreBuffer(app) if SCORE_WRITE_MODE == 'writebehind' else None
+
+def award_points(user_id, points, category, difficulty):
+    """Add points to a player and return their new score"""
+    if score_buffer:
+        score_buffer.add(user_id, points, category, difficulty)
+        return current_score(user_id)
+    return add_score(user_id, points, category, difficulty)
+
+def current_score(user_id):
+    """The player's score with one primary key select, plus points still waiting in the write-behind buffer.
+    Not from the user cache: other workers' score writes never reach this one's copy"""
+    score = db.session.scalar(db.select(User.score).where(User.id == user_id)) or 0
+    if score_buffer:
+        score += score_buffer.pending(user_id)
+    return score
+
+# Every answer is logged in batches, with running per-player stats
+answer_log = AnswerLog(app)
+
+# Served questions carry a signed token, so grading doesn't need them in the session
+answer_tokens = AnswerTokens(app.secret_key)
+
+def latency_ms(served_at):
+    """Milliseconds since a question was served, or None if we don't know"""
+    return int((time.time() - served_at) * 1000) if served_at else None
+
+# Where questions come from: 'api' (the prefetched pool), 'bank' (the Question table only, no network)
+# or 'snapshot' (a file written by question_snapshot.py, no database or network)
+QUESTION_SOURCE = os.getenv('QUESTION_SOURCE', 'api')
+
+# Mapped read-only, so with gunicorn every worker shares the same page-cache copy
+question_snapshot = None
+if QUESTION_SOURCE == 'snapshot':
+    question_snapshot = QuestionSnapshot(os.getenv('QUESTION_SNAPSHOT', 'questions.snap'))
+
+# One pooled client per worker, with rate limit pacing and a circuit breaker
+trivia_client = TriviaClient()
+
+def fetch_and_store_questions(category, difficulty, limit, background=False):
+    """Fetch a batch from the trivia API and keep a copy in the question bank.
+    Only background refills wait for a rate limit token, a request never sits behind one"""
+    max_wait = MAX_WAIT if background else INLINE_MAX_WAIT
+    try:
+        questions = trivia_client.fetch_questions(category, difficulty, limit, max_wait)
+    except UpstreamError as e:
+        # Upstream is degraded, so serve what we already have in the bank
+        logger.warning(f"{str(e)}. Falling back to the question bank.")
+        with app.app_context():
+            questions = [q.to_dict() for q in Question.random_batch(category, difficulty, limit)]
+        if questions:
+            return questions
+        if background or not isinstance(e, UpstreamUnavailable):
+            raise
+        # An empty bank (e.g. a fresh deploy) has nothing to fall back on, so wait one token interval after all
+        questions = trivia_client.fetch_questions(category, difficulty, limit, COLD_MAX_WAIT)
+
+    try:
+        with app.app_context():
+            save_questions(questions)
+    except Exception as e:
+        logger.error(f"Error saving questions to the bank: {str(e)}")
+    return questions
+
+# Questions are fetched from the trivia API in bulk and served from memory
+question_pool = QuestionPool(fetch=fetch_and_store_questions)
+
+def draw_question(category, difficulty):
+    """Get one question in the trivia API's format from the configured source"""
+    if question_snapshot is not None:
+        return question_snapshot.random(category, difficulty)
+    if QUESTION_SOURCE == 'bank':
+        question = Question.random(category, difficulty)
+        if question is None:
+            raise LookupError(f"No questions in the bank for {category}/{difficulty}")
+        return question.to_dict()
+    return question_pool.get(category, difficulty)
+
+def draw_questions(category, difficulty, count):
+    """Get up to count questions with one pool pop, snapshot read or bank query"""
+    if question_snapshot is not None:
+        return question_snapshot.random_batch(category, difficulty, count)
+    if QUESTION_SOURCE == 'bank':
+        questions = [q.to_dict() for q in Question.random_batch(category, difficulty, count)]
+        if not questions:
+            raise LookupError(f"No questions in the bank for {category}/{difficulty}")
+        return questions
+    return question_pool.get_many(category, difficulty, count)
+
+def no_questions_yet():
+    """503 page for when neither the trivia API nor the bank has questions right now. It retries itself"""
+    retry_after = max(1, math.ceil(COLD_MAX_WAIT))
+    page = render_template('unavailable.html', retry_after=retry_after, retry_url=request.full_path)
+    return page, 503, {'Retry-After': str(retry_after)}
+
+# Draws before we give up and serve a question the player has already seen
+SEEN_RETRIES = 5
+
+def load_seen():
+    """The player's seen-set, with one primary key select. Only question pages need it, so it's not in the session"""
+    row = db.session.get(SeenQuestions, current_user.id)
+    seen = SeenFilter.load(row.bits, row.count) if row else SeenFilter()
+    # Hand the connection back before drawing: the draw can wait on another request's
+    # pool fill, and that request needs a connection to save its batch
+    db.session.close()
+    return seen
+
+def next_question(category, difficulty):
+    """One question the player hasn't seen yet, checked against their seen-set"""
+    seen = load_seen()
+    for _ in range(SEEN_RETRIES):
+        question = draw_question(category, difficulty)
+        if question['id'] not in seen:
+            break
+    seen.add(question['id'])
+    save_seen(current_user.id, seen.dump(), seen.count)
+    return question
+
+def next_questions(category, difficulty, count):
+    """Up to count unseen questions for a round, topped up with seen ones if we run short"""
+    seen = load_seen()
+    fresh, repeats = [], []
+    for _ in range(2):
+        for question in draw_questions(category, difficulty, count):
+            (repeats if question['id'] in seen else fresh).append(question)
+        if len(fresh) >= count:
+            break
+    questions = (fresh + repeats)[:count]
+    for question in questions:
+        seen.add(question['id'])
+    save_seen(current_user.id, seen.dump(), seen.count)
+    return questions
+
+#------ ADAPTIVE DIFFICULTY ------#
+
+DIFFICULTIES = ('easy', 'medium', 'hard')
+ADAPTIVE_WINDOW = 10  # Answers the accuracy is measured over
+ADAPTIVE_MIN_ANSWERS = 5  # Answers needed before the difficulty moves
+
+def set_difficulty(difficulty):
+    """Store the chosen difficulty. 'adaptive' starts at medium and then follows the player's accuracy"""
+    if difficulty == 'adaptive':
+        if not session.get('adaptive'):
+            session['adaptive'] = True
+            session['difficulty'] = 'medium'
+            session['recent'] = []
+    else:
+        session['adaptive'] = False
+        session['difficulty'] = difficulty
+
+def adapt_difficulty(results):
+    """Move an adaptive player up after >= 80% recent accuracy and down after <= 40%"""
+    if not session.get('adaptive'):
+        return
+    recent = (session.get('recent', []) + [int(r) for r in results])[-ADAPTIVE_WINDOW:]
+    if len(recent) >= ADAPTIVE_MIN_ANSWERS:
+        accuracy = sum(recent) / len(recent)
+        level = DIFFICULTIES.index(session['difficulty'])
+        if accuracy >= 0.8 and level < len(DIFFICULTIES) - 1:
+            level += 1
+            recent = []
+        elif accuracy <= 0.4 and level > 0:
+            level -= 1
+            recent = []
+        session['difficulty'] = DIFFICULTIES[level]
+    session['recent'] = recent
+
+#------ End of ADAPTIVE DIFFICULTY ------#
 
 class LoginForm(FlaskForm):
     username = StringField('Username', validators=[InputRequired()])
@@ -157,7 +343,11 @@ def register():
             
             # Create new user and add to DB
             new_user = User(username=username, email=email, score=0)
-            new_user.set_password(password)  # Hash using bcrypt
+            try:
+                new_user.set_password(password)  # Hash using bcrypt
+            except HasherBusy:
+                flash('The server is busy, please try again in a moment', 'warning')
+                return redirect(url_for('register'))
 
             db.session.add(new_user)
             db.session.commit()
@@ -169,7 +359,34 @@ def register():
 
 #------ End of SELF REGISTRATION ------ #
 
-limiter = Limiter(app)
+#------ RATE LIMITS ------#
+
+# Counters live in shared storage (e.g. redis://host:6379/1) so every worker and
+# container counts against the same limit. memory:// is per process, for local dev
+app.config['RATELIMIT_STORAGE_URI'] = os.getenv('RATELIMIT_STORAGE_URI', 'memory://')
+app.config['RATELIMIT_STRATEGY'] = os.getenv('RATELIMIT_STRATEGY', 'sliding-window-counter')
+app.config['RATELIMIT_ENABLED'] = os.getenv('RATELIMIT_ENABLED', 'true').lower() == 'true'
+app.config['RATELIMIT_SWALLOW_ERRORS'] = True  # If the storage is down, serve rather than fail
+app.config['RATELIMIT_IN_MEMORY_FALLBACK_ENABLED'] = True
+
+# Gameplay quotas, per logged-in player and per client IP
+GAMEPLAY_USER_LIMIT = os.getenv('RATELIMIT_GAMEPLAY_USER', '60 per minute')
+GAMEPLAY_IP_LIMIT = os.getenv('RATELIMIT_GAMEPLAY_IP', '300 per minute')
+
+def user_or_ip():
+    """Rate limit key: the player's id when logged in, otherwise their IP"""
+    if current_user.is_authenticated:
+        return f"user:{current_user.id}"
+    return f"ip:{get_remote_address()}"
+
+limiter = Limiter(get_remote_address, app=app)
+
+def gameplay_limits(view):
+    """Apply the per-player and per-IP gameplay quotas to a view"""
+    view = limiter.limit(GAMEPLAY_USER_LIMIT, key_func=user_or_ip)(view)
+    return limiter.limit(GAMEPLAY_IP_LIMIT, key_func=get_remote_address)(view)
+
+#------ End of RATE LIMITS ------#
 
 @app.route('/login', methods=['POST'])
 @limiter.limit("5 per minute")  
@@ -185,9 +402,22 @@ def login():
 
         if user:
             if user.password_hash:  # Check if a password exists (i.e., non-Google user)
-                if user and bcrypt.check_password_hash(user.password_hash, password):
+                try:
+                    password_ok = user.check_password(password)
+                except HasherBusy:
+                    flash('The server is busy, please try again in a moment', 'warning')
+                    return redirect(url_for('index'))
+                if password_ok:
+                    # Upgrade the hash if BCRYPT_LOG_ROUNDS changed since it was made
+                    if user.password_needs_rehash():
+                        try:
+                            user.set_password(password)
+                            db.session.commit()
+                        except HasherBusy:
+                            pass  # Try again on the next login
                     # If the user is found and the password matches, log the user in
                     login_user(user)  # This stores user.id in the session, not the username
+                    user_cache.put(user)  # Start from a fresh copy
                     session.pop('_flashes', None)  # Remove any flash messages that might remain
                     flash('Logged in successfully!', 'success')
                     return redirect(url_for('choose_category'))                
@@ -205,7 +435,7 @@ def login():
 def set_csrf_token():
     if 'csrf_token' not in session:
         session['csrf_token'] = secrets.token_hex(16)
-        logger.info(f"CSRF Token Created: {session['csrf_token']}")
+        logger.debug("CSRF token created")  # Never log the token itself
 
 
 #------ GOOGLE LOGIN ------#
@@ -317,23 +547,11 @@ def callback():
 
 
 
-# Create a player session
-def initialize_player_session(username):
-    """Initialize the player session for a single player if it's not already set."""
-    if 'username' not in session:
-        session['username'] = username  # Store the player's name in the session
-
-    if 'score' not in session:
-        session['score'] = 0  # Initialize the player's score if not set
-
-
-@app.route('/choose_category', methods=['GET', 'POST'])
-def choose_category():    
-    def generate_categories(*category_tuples):
+def generate_categories(*category_tuples):
     # Generate list of dictionaries from tuples.  The name is needed for the API call later
-        return [{"name": name, "displayname": display} for name, display in category_tuples]
+    return [{"name": name, "displayname": display} for name, display in category_tuples]
 
-    categories = generate_categories(
+CATEGORIES = generate_categories(
     ("music", "Music"),
     ("sport_and_leisure", "Sport and Leisure"),
     ("film_and_tv", "Film and TV"),
@@ -344,8 +562,36 @@ def choose_category():
     ("geography", "Geography"),
     ("food_and_drink", "Food and Drink"),
     ("general_knowledge", "General Knowledge")
-    )
+)
+
+# Pages that look the same for every player are rendered once per worker
+STARTED_AT = datetime.now(timezone.utc).replace(microsecond=0)
+rendered_pages = {}
+
+def render_shared_page(template, **context):
+    """Render a player-independent page once, then serve it with ETag/Last-Modified and 304s"""
+    page = rendered_pages.get(template)
+    if page is None:
+        html = render_template(template, **context)
+        page = (html, hashlib.sha256(html.encode()).hexdigest()[:16])
+        rendered_pages[template] = page
+
+    response = make_response(page[0])
+    response.set_etag(page[1])
+    response.last_modified = STARTED_AT
+    response.cache_control.private = True
+    response.cache_control.no_cache = True  # Revalidate each time, the page is behind a login
+    return response.make_conditional(request)
+
+# Create a player session
+def initialize_player_session(username):
+    """Initialize the player session for a single player if it's not already set."""
+    if 'username' not in session:
+        session['username'] = username  # Store the player's name in the session
+
 
+@app.route('/choose_category', methods=['GET', 'POST'])
+def choose_category():    
     # Checks if players exist or not
     username = current_user.username
     if not username:
@@ -358,14 +604,21 @@ def choose_category():
         # Get selected category ID and difficulty
         chosen_category_id = request.form['category']
         difficulty = request.form['difficulty']
+        round_size = request.form.get('round_size', 1, type=int)
+
+        # More than one question per page is a round
+        if round_size > 1:
+            return redirect(url_for('ask_round', category=chosen_category_id, difficulty=difficulty, size=round_size))
 
         # Redirect to the ask_question page with the selected category ID and difficulty
         return redirect(url_for('ask_question', category=chosen_category_id, difficulty=difficulty))
 
-    return render_template('choose_category.html', 
-                            categories=categories)
+    return render_shared_page('choose_category.html', 
+                              categories=CATEGORIES,
+                              round_sizes=ROUND_SIZES)
 
 @app.route('/ask_question', methods=['GET'])
+@gameplay_limits
 def ask_question():
     # Checks if players exist or not
     username = current_user.username
@@ -380,7 +633,9 @@ def ask_question():
 
     # Try to get category and difficulty from request args first, fallback to session
     category = request.args.get('category') or session.get('category')
-    difficulty = request.args.get('difficulty') or session.get('difficulty')
+    if request.args.get('difficulty'):
+        set_difficulty(request.args['difficulty'])
+    difficulty = session.get('difficulty')
 
     if not category or not difficulty:
         logger.error("Category or difficulty is missing! Redirecting to category selection.")
@@ -388,47 +643,30 @@ def ask_question():
 
     # Saving just about everything to the session.  I'm not sure what all will be used
     session['category'] = category 
-    session['difficulty'] = difficulty
 
-    url = f"https://the-trivia-api.com/v2/questions?categories={category}&difficulties={difficulty}&limit=1"  
-
-    # Pulls the question and answers
+    # Pulls the question and answers from the pool or the question bank
     try:
-        response = requests.get(url)
-        # Logging the json output
-        logger.info(f"Request: {response.request.method} {response.url} | Status_Code: {response.status_code} | Response Body: {json.dumps(response.json(), indent=2)}")
-        # For timed retries.  When it returns 429 wait 5 seconds which is their rate limit
-        if response.status_code == 429:
-            time.sleep(5)
-            response = requests.get(url)
-            # Log the request details for the retry
-            logger.info(f"Request: {response.request.method} {response.url} | Status_Code: {response.status_code}")
-        # Here is what happens after success
-        if response.status_code == 200:
-            logger.info(f"Request: {response.request.method} {response.url} | Status_Code: {response.status_code}")
-            question_data = response.json()[0]
-            
-            # Answers get saved
-            answers = question_data['incorrectAnswers'] + [question_data['correctAnswer']]
-            random.shuffle(answers)  # Shuffle so the correct answer isn't always in the same spot 
-
-            #Save the question_data as question.  
-            session['question'] = question_data  # Save the question for the next page      
-                 
-        else:
-            logger.error(f"Error fetching question. Status code: {response.status_code}")
-            return "Error occurred while fetching the question."    
-
-        return render_template('ask_question.html', 
-                           question=question_data['question'], 
-                           answers=answers)
-    
+        question_data = next_question(category, difficulty)
+    except (UpstreamError, LookupError) as e:
+        logger.error(f"Error fetching question: {str(e)}")
+        return no_questions_yet()
     except Exception as e:
         logger.error(f"Error fetching question: {str(e)}")
         return f"Error occurred: {str(e)}"
+
+    # Answers come in a precomputed random order, signed with where the correct one is.
+    # The session only keeps the nonce, so each question can be answered once
+    session['question'] = new_nonce()
+    answers, token = answer_tokens.deal(question_data, session['question'])
+
+    return render_template('ask_question.html', 
+                           question=question_data['question'], 
+                           answers=answers,
+                           token=token)
         
 
 @app.route('/answer', methods=['GET', 'POST'])
+@gameplay_limits
 def answer():
     # In case someone goes directly to the page
     if request.method == ['GET'] :
@@ -440,47 +678,271 @@ def answer():
     if not username:
         return redirect(url_for('index')) 
          
-    user = User.query.filter_by(username=username).first() # Fetch the user from the database
+    # The form sends back the answers it showed, the chosen index and the question's token
+    answers = request.form.getlist('choice')
+    selected = request.form.get('answer', type=int)
 
-    # Save the selected answer into the session    
-    selected_answer = request.form.get('answer')
-
-    if not selected_answer:
+    if selected is None or not 0 <= selected < len(answers):
         logger.error("No answer selected!")
         return redirect(url_for('ask_question'))  # If no answer is selected, redirect back
-        
-    session['selected_answer'] = selected_answer  # Save the selected answer to session 
 
-    # Get the correct answer from session
-    question = session.get('question')
-    if not question:
-        logger.error("No question found in session!")
+    # Grade against the token's signature, the session only holds the outstanding nonce
+    try:
+        question_id, served_at, nonce, correct = answer_tokens.check(request.form.get('token'), answers)
+    except InvalidToken as e:
+        logger.error(f"Rejected answer: {str(e)}")
         return redirect(url_for('ask_question'))  # Redirect to fetch a new question
+    if nonce != session.pop('question', None):
+        logger.error("Question was already answered or is not this session's!")
+        return redirect(url_for('ask_question'))
 
-    correctAnswer = question.get('correctAnswer')  
+    selected_answer = answers[selected]
+    correctAnswer = answers[correct]
 
-    if selected_answer == correctAnswer:
+    answer_log.record(current_user.id, question_id, session['category'], session['difficulty'],
+                      selected == correct, latency_ms(served_at))
+
+    if selected == correct:
         # Determine points based on difficulty
-        if session['difficulty'] == 'easy':
-            points = 1
-        elif session['difficulty'] == 'medium':
-            points = 2
-        elif session['difficulty'] == 'hard':
-            points = 3
-          
-        user.score += points  # Add the calculated points
-        score = user.score
+        points = POINTS[session['difficulty']]
+        score = award_points(current_user.id, points, session['category'], session['difficulty'])  # Atomic increment, no read-modify-write
         session.modified = True  # Ensure session updates are saved 
     else:
-        score = user.score
+        score = current_score(current_user.id)
+
+    # In adaptive mode the next question's difficulty follows recent accuracy
+    adapt_difficulty([selected == correct])
 
-    # Commit the score to the db
-    db.session.commit()
     return render_template('answer.html', 
                            selected_answer=selected_answer, 
                            correctAnswer=correctAnswer,
                            score=score)
 
+
+#------ ROUNDS ------#
+
+@app.route('/round', methods=['GET'])
+@gameplay_limits
+def ask_round():
+    """Several questions on one page, fetched together and graded in one POST"""
+    username = current_user.username
+    if not username:
+        return redirect(url_for('index'))
+
+    initialize_player_session(username)
+
+    category = request.args.get('category') or session.get('category')
+    if request.args.get('difficulty'):
+        set_difficulty(request.args['difficulty'])
+    difficulty = session.get('difficulty')
+    size = request.args.get('size', type=int) or session.get('round_size') or ROUND_SIZES[-1]
+    if not category or not difficulty:
+        return redirect(url_for('choose_category'))
+    size = max(1, min(size, ROUND_SIZES[-1]))
+
+    session['category'] = category
+    session['round_size'] = size
+
+    try:
+        questions = next_questions(category, difficulty, size)
+    except (UpstreamError, LookupError) as e:
+        logger.error(f"Error fetching round: {str(e)}")
+        return no_questions_yet()
+    except Exception as e:
+        logger.error(f"Error fetching round: {str(e)}")
+        return f"Error occurred: {str(e)}"
+
+    # Same as ask_question, one signed token per question and one nonce for the round
+    session['round'] = new_nonce()
+    rounds = []
+    for question in questions:
+        answers, token = answer_tokens.deal(question, session['round'])
+        rounds.append({'question': question['question'], 'answers': answers, 'token': token})
+
+    return render_template('round.html', rounds=rounds)
+
+@app.route('/answer_round', methods=['POST'])
+@gameplay_limits
+def answer_round():
+    username = current_user.username
+    if not username:
+        return redirect(url_for('index'))
+
+    round_nonce = session.pop('round', None)
+    if not round_nonce:
+        logger.error("No round found in session!")
+        return redirect(url_for('ask_round'))
+
+    # Check every token before anything is logged or scored
+    graded = []
+    for i in range(min(request.form.get('questions', 0, type=int), ROUND_SIZES[-1])):
+        answers = request.form.getlist(f'choice-{i}')
+        selected = request.form.get(f'answer-{i}', type=int)
+        try:
+            question_id, served_at, nonce, right = answer_tokens.check(request.form.get(f'token-{i}'), answers)
+        except InvalidToken as e:
+            logger.error(f"Rejected round answer: {str(e)}")
+            return redirect(url_for('ask_round'))
+        if nonce != round_nonce or any(question_id == g[0] for g in graded):
+            logger.error("Round was already answered or is not this session's!")
+            return redirect(url_for('ask_round'))
+        graded.append((question_id, served_at, answers, selected, right))
+
+    results = []
+    correct = 0
+    for question_id, served_at, answers, selected, right in graded:
+        is_correct = selected == right
+        correct += is_correct
+        answer_log.record(current_user.id, question_id, session['category'], session['difficulty'],
+                          is_correct, latency_ms(served_at))
+        selected_answer = answers[selected] if selected is not None and 0 <= selected < len(answers) else None
+        results.append({'selected_answer': selected_answer,
+                        'correctAnswer': answers[right],
+                        'correct': is_correct})
+
+    # One score write for the whole round
+    if correct:
+        score = award_points(current_user.id, correct * POINTS[session['difficulty']],
+                             session['category'], session['difficulty'])
+    else:
+        score = current_score(current_user.id)
+
+    adapt_difficulty([r['correct'] for r in results])
+
+    return render_template('round_result.html', results=results, correct=correct, score=score)
+
+#------ End of ROUNDS ------#
+
+#------ LIVE ROOMS ------#
+
+def score_room_round(room, question, results):
+    """Log and score every answer from one room round with a single score write"""
+    points = POINTS[room.difficulty]
+    increments = {}
+    for user_id, correct in results:
+        answer_log.record(user_id, question['id'], room.category, room.difficulty, correct)
+        if correct:
+            increments[(user_id, room.category, room.difficulty)] = points
+
+    if score_buffer:
+        for (user_id, category, difficulty), pts in increments.items():
+            score_buffer.add(user_id, pts, category, difficulty)
+        return
+    add_scores(increments)
+
+# Rooms are shared through Redis/Valkey, by default the rate limiter's. With memory://
+# they live in one worker, which only works for a single-process server
+ROOMS_STORAGE_URI = os.getenv('ROOMS_STORAGE_URI', app.config['RATELIMIT_STORAGE_URI'])
+if ROOMS_STORAGE_URI.startswith('memory://'):
+    room_manager = RoomManager(app, draw_question, score_room_round)
+else:
+    room_manager = SharedRoomManager(app, ROOMS_STORAGE_URI, draw_question, score_room_round)
+
+def rooms_available():
+    """In-memory rooms would be split between workers, so they're off when gunicorn runs more than one.
+    gunicorn.conf.py sets GUNICORN_WORKERS"""
+    return isinstance(room_manager, SharedRoomManager) or int(os.getenv('GUNICORN_WORKERS', 1)) <= 1
+
+def rooms_enabled(view):
+    """Answer 503 on a room route while rooms are off"""
+    @wraps(view)
+    def wrapped(*args, **kwargs):
+        if not rooms_available():
+            abort(503, "Live rooms need ROOMS_STORAGE_URI pointing at Redis/Valkey when running several workers")
+        return view(*args, **kwargs)
+    return wrapped
+
+@app.route('/rooms', methods=['GET', 'POST'])
+@rooms_enabled
+def rooms():
+    if not current_user.is_authenticated:
+        return redirect(url_for('index'))
+
+    if request.method == 'POST':
+        category = request.form['category']
+        difficulty = request.form['difficulty']
+        if difficulty not in POINTS or category not in {c['name'] for c in CATEGORIES}:
+            abort(400)
+        room = room_manager.create(category, difficulty)
+        return redirect(url_for('room', room_id=room.id))
+
+    names = {c['name']: c['displayname'] for c in CATEGORIES}
+    return render_template('rooms.html', rooms=room_manager.listing(), categories=CATEGORIES, names=names)
+
+@app.route('/rooms/<room_id>', methods=['GET'])
+@rooms_enabled
+def room(room_id):
+    if not current_user.is_authenticated:
+        return redirect(url_for('index'))
+    room = room_manager.get(room_id)
+    if room is None:
+        flash('That room has closed.', 'warning')
+        return redirect(url_for('rooms'))
+    names = {c['name']: c['displayname'] for c in CATEGORIES}
+    return render_template('room.html', room=room, category=names.get(room.category, room.category))
+
+@app.route('/rooms/<room_id>/stream', methods=['GET'])
+@rooms_enabled
+def room_stream(room_id):
+    if not current_user.is_authenticated:
+        abort(401)
+    room = room_manager.get(room_id)
+    if room is None:
+        abort(404)
+    stream = room_manager.stream(room, current_user.id, current_user.username)
+    response = Response(stream, mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # Don't let a proxy hold events back
+    return response
+
+@app.route('/rooms/<room_id>/answer', methods=['POST'])
+@gameplay_limits
+@rooms_enabled
+def room_answer(room_id):
+    if not current_user.is_authenticated:
+        abort(401)
+    room = room_manager.get(room_id)
+    if room is None:
+        abort(404)
+    data = request.get_json(silent=True) or {}
+    accepted = room_manager.answer(room, current_user.id, data.get('round'), data.get('answer'))
+    return jsonify(accepted=accepted), (200 if accepted else 409)
+
+#------ End of LIVE ROOMS ------#
+
+@app.route('/stats', methods=['GET'])
+def stats():
+    """The player's accuracy and streaks, read from the running aggregates"""
+    if not current_user.is_authenticated:
+        return redirect(url_for('index'))
+
+    rows = PlayerStats.query.filter_by(user_id=current_user.id).order_by(
+        PlayerStats.category, PlayerStats.difficulty).all()
+    names = {c['name']: c['displayname'] for c in CATEGORIES}
+    return render_template('stats.html', rows=rows, names=names,
+                           answered=sum(r.answered for r in rows),
+                           correct=sum(r.correct for r in rows))
+
+leaderboard = Leaderboard()
+
+@app.route('/leaderboard', methods=['GET'])
+def show_leaderboard():
+    category = request.args.get('category') or None
+    difficulty = request.args.get('difficulty') or None
+    if not (category and difficulty):
+        category = difficulty = None  # A board needs both, otherwise show the global one
+
+    my_rank = None
+    if current_user.is_authenticated:
+        my_rank = leaderboard.rank(current_user.id, category, difficulty)
+
+    return render_template('leaderboard.html',
+                           categories=CATEGORIES,
+                           category=category,
+                           difficulty=difficulty,
+                           top=leaderboard.top(category, difficulty),
+                           my_rank=my_rank)
+
     
 if __name__ == "__main__":
     with app.app_context():
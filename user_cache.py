@@ -0,0 +1,54 @@
+# user_cache.py
+# Process-wide LRU/TTL cache of user records for the login user_loader, so a
+# steady-state request does not have to hit the database to know who is playing.
+from collections import OrderedDict
+import threading
+import time
+import os
+
+from flask_login import UserMixin
+
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', 10000))
+USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL', 60))  # Seconds
+
+
+class CachedUser(UserMixin):
+    """A detached copy of the User columns that pages read. The score isn't one of
+    them: any worker can change it, so pages read it from the database"""
+
+    def __init__(self, id, username, email):
+        self.id = id
+        self.username = username
+        self.email = email
+
+    @classmethod
+    def from_user(cls, user):
+        return cls(user.id, user.username, user.email)
+
+
+class UserCache:
+    def __init__(self, size=USER_CACHE_SIZE, ttl=USER_CACHE_TTL):
+        self.size = size
+        self.ttl = ttl
+        self._users = OrderedDict()  # user_id -> (expires, CachedUser), oldest first
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._users[user_id]
+                return None
+            self._users.move_to_end(user_id)
+            return entry[1]
+
+    def put(self, user):
+        cached = CachedUser.from_user(user)
+        with self._lock:
+            self._users[cached.id] = (time.monotonic() + self.ttl, cached)
+            self._users.move_to_end(cached.id)
+            while len(self._users) > self.size:
+                self._users.popitem(last=False)
+        return cached